@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Micro-benchmark for the time codec and month arithmetic at
+    lib/dateutils.py, compared with the standard library implementations
+    they replace
+"""
+
+from calendar import timegm
+from datetime import datetime, timedelta
+from optparse import OptionParser
+from os import path
+from random import Random
+from timeit import Timer
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from lib.dateutils import EC2_TIME_FORMAT, epoch_to_strf  # noqa: E402
+from lib.dateutils import strf_to_epoch, timedelta_months  # noqa: E402
+
+
+def strptime_to_epoch(string):
+    return(timegm(datetime.strptime(string, EC2_TIME_FORMAT).timetuple()))
+
+
+def strftime_from_epoch(epoch):
+    return(datetime.utcfromtimestamp(epoch).strftime(EC2_TIME_FORMAT))
+
+
+def loop_timedelta_months(date, nmonths):
+    first_day = datetime(date.year, date.month, 1)
+    for i in range(0, nmonths):
+        first_day = datetime(first_day.year, first_day.month, 1)
+        first_day = first_day - timedelta(days=1)
+        first_day = datetime(first_day.year, first_day.month, 1)
+    return(first_day)
+
+
+def per_call(function, args, repeat):
+    """ Return the best time per call (microseconds) for a list of args """
+    timer = Timer(lambda: [function(*arg) for arg in args])
+    return(min(timer.repeat(repeat, 1)) / len(args) * 1000000)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]",
+                          description='Micro-benchmark for lib/dateutils.py')
+    parser.add_option('--calls', action='store', type='int', default=100000,
+                      help='Number of calls per measure [default is 100000]')
+    parser.add_option('--repeat', action='store', type='int', default=5,
+                      help='Number of measures, the best one is reported'
+                           ' [default is 5]')
+    (options, args) = parser.parse_args()
+    random = Random(0)
+    # Three snapshots per day for ten years, as a typical inventory
+    now = timegm(datetime.utcnow().timetuple())
+    epochs = [now - random.randint(0, 3650) * 86400 - random.randint(0, 2) *
+              1800 for i in range(options.calls)]
+    strings = [(strftime_from_epoch(epoch),) for epoch in epochs]
+    epochs = [(epoch,) for epoch in epochs]
+    dates = [(datetime.utcfromtimestamp(epoch[0]), random.randint(0, 120))
+             for epoch in epochs]
+    benchmarks = [('parse', strptime_to_epoch, strf_to_epoch, strings),
+                  ('format', strftime_from_epoch, epoch_to_strf, epochs),
+                  ('timedelta_months', loop_timedelta_months,
+                   timedelta_months, dates)]
+    print "%-18s %14s %14s %8s" % ('function', 'before (us)', 'after (us)',
+                                   'speedup')
+    for name, before, after, calls in benchmarks:
+        before_time = per_call(before, calls, options.repeat)
+        after_time = per_call(after, calls, options.repeat)
+        print "%-18s %14.3f %14.3f %7.1fx" % (name, before_time, after_time,
+                                              before_time / after_time)
+
+
+if __name__ == "__main__":
+    main()
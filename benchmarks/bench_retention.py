@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Benchmark suite for the snapshot retention engine
+
+    Runs clean_snapshots_by_volume_id in test mode for several inventory
+    sizes and retention policies or, with --cadence, computes the retention
+    for synthetic volumes from lib/workload.py until the inventory size is
+    reached. Every case runs in its own process, so the peak memory of a
+    case is not affected by the previous ones. Results are written as JSON
+    Lines, one line per case.
+
+    With --tune, the policies are evaluated over the same test mode
+    inventory with the NumPy keep mask, as when tuning a retention policy.
+"""
+
+from optparse import OptionParser
+from os import path
+from subprocess import PIPE, Popen
+from time import time
+import gc
+import json
+import platform
+import resource
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from lib.workload import CADENCES  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Inventory sizes (snapshots for a volume)
+SIZES = [1000, 10000, 100000, 1000000]
+
+# Retention policies: (hourly, daily, weekly, monthly)
+POLICIES = {
+    'default': (0, 7, 4, True),
+    'hourly': (24, 7, 4, 12),
+    'long': (48, 30, 52, True),
+    'none': (0, 0, 0, False),
+}
+
+
+def run_test_mode(size, hourly, daily, weekly, monthly):
+    """ Compute the retention for test mode snapshots
+
+    Returns:
+        A tuple (snapshots, saved, volumes)
+    """
+    from lib.snapshots import clean_snapshots_by_volume_id
+    # Test mode creates three snapshots per day
+    snapshots = clean_snapshots_by_volume_id(None, None, hourly, daily,
+                                             weekly, monthly, False, True,
+                                             (size + 2) // 3)
+    return((len(snapshots),
+            len([s for s in snapshots if s.type is not None]), 1))
+
+
+def run_workload(size, hourly, daily, weekly, monthly, cadence, years):
+    """ Compute the retention for synthetic volumes, one at a time, until
+        there are size snapshots
+
+    Returns:
+        A tuple (snapshots, saved, volumes)
+    """
+    from datetime import datetime
+    from itertools import count, islice
+    from lib.retention import classify_snapshots
+    from lib.workload import Workload
+    workload = Workload(cadence=cadence, years=years)
+    now = datetime.utcfromtimestamp(workload.now)
+    total = 0
+    saved = 0
+    volumes = 0
+    # Volumes are generated one at a time until there are enough snapshots
+    for index in count():
+        snapshots = workload.iter_snapshots(index)
+        snapshots = classify_snapshots(list(islice(snapshots, size - total)),
+                                       hourly, daily, weekly, monthly, now)
+        total += len(snapshots)
+        saved += len([s for s in snapshots if s.type is not None])
+        volumes += 1
+        if total >= size:
+            break
+    return((total, saved, volumes))
+
+
+def run_case(size, policy, cadence=None, years=2):
+    """ Run a single case in this process
+
+    Args:
+        size: An integer with the number of snapshots
+        policy: A string with the policy name (see POLICIES)
+        cadence: A string with the cadence of the synthetic volumes (see
+                 lib/workload.py), or None to use the test mode snapshots
+        years: A number with the years of snapshots for synthetic volumes
+    Returns:
+        A dict with the results
+    """
+    from lib.retention_numpy import numpy_available
+    hourly, daily, weekly, monthly = POLICIES[policy]
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time()
+    if cadence is None:
+        total, saved, volumes = run_test_mode(size, hourly, daily, weekly,
+                                              monthly)
+    else:
+        total, saved, volumes = run_workload(size, hourly, daily, weekly,
+                                             monthly, cadence, years)
+    wall = time() - start
+    result = {'size': total, 'policy': policy, 'volumes': volumes,
+              'workload': cadence or 'test', 'years': years,
+              'hourly': hourly, 'daily': daily, 'weekly': weekly,
+              'monthly': monthly, 'saved': saved,
+              'wall_seconds': round(wall, 6),
+              'peak_rss_kb': resource.getrusage(
+                  resource.RUSAGE_SELF).ru_maxrss,
+              'rss_growth_kb': resource.getrusage(
+                  resource.RUSAGE_SELF).ru_maxrss - rss_before,
+              'live_objects': len(gc.get_objects()) - objects_before,
+              'traced_peak_bytes': None, 'traced_blocks': None,
+              'numpy': numpy_available(),
+              'python': platform.python_version()}
+    if tracemalloc is not None:
+        result['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        result['traced_blocks'] = len(tracemalloc.take_snapshot().traces)
+        tracemalloc.stop()
+    return(result)
+
+
+def run_tuning(size, policies):
+    """ Evaluate retention policies over the same test mode inventory with
+        the NumPy keep mask. The start times are built once, so only the
+        retention is measured for every policy
+
+    Args:
+        size: An integer with the number of snapshots
+        policies: A list of strings with the policy names
+    Returns:
+        A list of dicts with the results, one for each policy
+    """
+    from datetime import datetime
+    from lib.retention_numpy import keep_mask, test_start_times
+    now = datetime.utcnow()
+    start = time()
+    # Test mode creates three snapshots per day
+    times = test_start_times((size + 2) // 3, now)
+    build = time() - start
+    results = []
+    for policy in policies:
+        hourly, daily, weekly, monthly = POLICIES[policy]
+        start = time()
+        saved = int(keep_mask(times, hourly, daily, weekly, monthly,
+                              now).sum())
+        results.append({'size': len(times), 'policy': policy,
+                        'workload': 'tune', 'hourly': hourly,
+                        'daily': daily, 'weekly': weekly,
+                        'monthly': monthly, 'saved': saved,
+                        'wall_seconds': round(time() - start, 6),
+                        'build_seconds': round(build, 6), 'numpy': True,
+                        'python': platform.python_version()})
+    return(results)
+
+
+def run_tuning_suite(sizes, policies, output):
+    """ Run the policy tuning for every size and write the results
+
+    Args:
+        sizes: A list of integers with the inventory sizes
+        policies: A list of strings with the policy names
+        output: A file object for the JSON Lines results
+    """
+    for size in sizes:
+        for result in run_tuning(size, policies):
+            output.write("%s\n" % json.dumps(result, sort_keys=True))
+            output.flush()
+            sys.stderr.write("%8s %-8s %10.3fs\n"
+                             % (size, result['policy'],
+                                result['wall_seconds']))
+
+
+def run_suite(sizes, policies, output, cadence=None, years=2):
+    """ Run every case in a child process and write the results
+
+    Args:
+        sizes: A list of integers with the inventory sizes
+        policies: A list of strings with the policy names
+        output: A file object for the JSON Lines results
+        cadence: A string with the cadence of the synthetic volumes, or None
+                 to use the test mode snapshots
+        years: A number with the years of snapshots for synthetic volumes
+    Returns:
+        An integer with the number of failed cases
+    """
+    failed = 0
+    for size in sizes:
+        for policy in policies:
+            command = [sys.executable, path.abspath(__file__),
+                       '--case', '%s:%s' % (size, policy),
+                       '--years', str(years)]
+            if cadence is not None:
+                command += ['--cadence', cadence]
+            child = Popen(command, stdout=PIPE)
+            stdout = child.communicate()[0]
+            if child.returncode != 0:
+                sys.stderr.write("Case %s:%s failed\n" % (size, policy))
+                failed += 1
+                continue
+            result = json.loads(stdout)
+            output.write("%s\n" % json.dumps(result, sort_keys=True))
+            output.flush()
+            sys.stderr.write("%8s %-8s %10.3fs %10s KB\n"
+                             % (size, policy, result['wall_seconds'],
+                                result['peak_rss_kb']))
+    return(failed)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]",
+                          description='Benchmark suite for the snapshot'
+                                      ' retention engine')
+    parser.add_option('--sizes', action='store',
+                      default=','.join([str(size) for size in SIZES]),
+                      help='Comma separated inventory sizes [default is %s]'
+                           % ','.join([str(size) for size in SIZES]))
+    parser.add_option('--policies', action='store',
+                      default=','.join(sorted(POLICIES)),
+                      help='Comma separated policies, from %s [default is'
+                           ' all]' % ', '.join(sorted(POLICIES)))
+    parser.add_option('--cadence', action='store',
+                      help='Use synthetic volumes with this cadence (%s or'
+                           ' mixed) instead of the test mode snapshots'
+                           % ', '.join(sorted(CADENCES)))
+    parser.add_option('--years', action='store', type='float', default=2,
+                      help='Years of snapshots for each synthetic volume'
+                           ' [default is 2]')
+    parser.add_option('--output', action='store',
+                      help='File for the JSON Lines results [default is'
+                           ' stdout]')
+    parser.add_option('--tune', action='store_true', default=False,
+                      help='Evaluate all the policies over the same test'
+                           ' mode inventory with the NumPy keep mask,'
+                           ' measuring only the retention')
+    parser.add_option('--case', action='store',
+                      help='Run a single case size:policy in this process')
+    (options, args) = parser.parse_args()
+    if options.case is not None:
+        size, policy = options.case.split(':')
+        print json.dumps(run_case(int(size), policy, options.cadence,
+                                  options.years))
+        return
+    try:
+        sizes = [int(value) for value in options.sizes.split(',')]
+    except ValueError:
+        parser.error("--sizes must be a list of integers")
+    policies = options.policies.split(',')
+    for policy in policies:
+        if policy not in POLICIES:
+            parser.error("Unknown policy %s" % policy)
+    if (options.cadence is not None and options.cadence != 'mixed' and
+            options.cadence not in CADENCES):
+        parser.error("Unknown cadence %s" % options.cadence)
+    if options.tune:
+        from lib.retention_numpy import numpy_available
+        if not numpy_available():
+            parser.error("--tune needs NumPy")
+        if options.cadence is not None:
+            parser.error("--tune uses the test mode snapshots, --cadence"
+                         " can not be used")
+        if options.output is not None:
+            with open(options.output, 'w') as output:
+                run_tuning_suite(sizes, policies, output)
+        else:
+            run_tuning_suite(sizes, policies, sys.stdout)
+        return
+    if options.output is not None:
+        with open(options.output, 'w') as output:
+            failed = run_suite(sizes, policies, output, options.cadence,
+                               options.years)
+    else:
+        failed = run_suite(sizes, policies, sys.stdout, options.cadence,
+                           options.years)
+    if failed > 0:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
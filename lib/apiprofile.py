@@ -0,0 +1,235 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from atexit import register
+from bisect import bisect_left
+from messages import print_report
+from threading import Lock
+import json
+
+# Upper bounds (seconds) of the latency histogram buckets. Calls slower than
+# the last bound are counted in an extra bucket
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# The profile for the run, see enable_profile
+_profile = None
+
+
+class ActionStats(object):
+    """ Accounting for the calls to an EC2 API action
+
+    Properties:
+        calls: An integer with the number of requests, including retries
+        errors: An integer with the number of failed requests, not counting
+                the throttled ones
+        retries: An integer with the number of throttled requests that were
+                 retried
+        seconds: A float with the total time (seconds) of the requests
+        max_seconds: A float with the time (seconds) of the slowest request
+        rate_wait: A float with the time (seconds) spent waiting for the
+                   client rate limit
+        backoff: A float with the time (seconds) spent in backoff before
+                 retrying throttled requests
+        histogram: A list with the number of requests for each bucket in
+                   LATENCY_BUCKETS, plus one for slower requests
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rate_wait = 0.0
+        self.backoff = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def to_dict(self):
+        # The last bucket has no upper bound
+        bounds = list(LATENCY_BUCKETS) + [None]
+        return({'calls': self.calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'seconds': round(self.seconds, 3),
+                'mean_seconds': round(self.seconds / max(self.calls, 1), 4),
+                'max_seconds': round(self.max_seconds, 4),
+                'rate_wait_seconds': round(self.rate_wait, 3),
+                'backoff_seconds': round(self.backoff, 3),
+                'histogram': [{'le': bound, 'count': count} for bound, count
+                              in zip(bounds, self.histogram)]})
+
+
+class WaitStats(object):
+    """ Accounting for the waits for a resource type (see waiter.py)
+
+    Properties:
+        waits: An integer with the number of waits
+        seconds: A float with the total time (seconds) callers were waiting
+        polls: An integer with the number of Describe calls to poll
+        polled: An integer with the number of resources polled
+    """
+
+    def __init__(self):
+        self.waits = 0
+        self.seconds = 0.0
+        self.polls = 0
+        self.polled = 0
+
+    def to_dict(self):
+        return({'waits': self.waits,
+                'seconds': round(self.seconds, 3),
+                'polls': self.polls,
+                'polled': self.polled})
+
+
+class ApiProfile(object):
+    """ Accounting of the EC2 API calls and waits of a run, by region and
+        action
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.actions = {}
+        self.waits = {}
+
+    def _action(self, region, action):
+        stats = self.actions.get((region, action))
+        if stats is None:
+            stats = self.actions[(region, action)] = ActionStats()
+        return(stats)
+
+    def _wait(self, rtype):
+        stats = self.waits.get(rtype)
+        if stats is None:
+            stats = self.waits[rtype] = WaitStats()
+        return(stats)
+
+    def record_call(self, region, action, seconds, rate_wait, failed):
+        with self.lock:
+            stats = self._action(region, action)
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rate_wait += rate_wait
+            stats.histogram[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            if failed:
+                stats.errors += 1
+
+    def record_retry(self, region, action, backoff):
+        with self.lock:
+            stats = self._action(region, action)
+            stats.retries += 1
+            stats.backoff += backoff
+
+    def record_wait(self, rtype, seconds):
+        with self.lock:
+            stats = self._wait(rtype)
+            stats.waits += 1
+            stats.seconds += seconds
+
+    def record_poll(self, rtype, resources):
+        with self.lock:
+            stats = self._wait(rtype)
+            stats.polls += 1
+            stats.polled += resources
+
+    def summary(self):
+        """ Get the accounting as a dict
+
+        Returns:
+            A dict with the totals, the stats for each region and action, and
+            the stats for the waits of each resource type
+        """
+        with self.lock:
+            actions = sorted(self.actions.iteritems())
+            waits = sorted(self.waits.iteritems())
+            return({
+                'calls': sum([stats.calls for key, stats in actions]),
+                'retries': sum([stats.retries for key, stats in actions]),
+                'seconds': round(sum([stats.seconds for key, stats
+                                      in actions]), 3),
+                'actions': [dict(region=region, action=action,
+                                 **stats.to_dict())
+                            for (region, action), stats in actions],
+                'waits': dict([(rtype, stats.to_dict())
+                               for rtype, stats in waits])})
+
+
+def enable_profile(output=None):
+    """ Start the accounting of the EC2 API calls for the run. At exit, the
+        summary is printed, and written as JSON if requested
+
+    Args:
+        output: A string with the path of the JSON file for the summary
+                (optional)
+    """
+    global _profile
+    _profile = ApiProfile()
+    register(finish_profile, _profile, output)
+
+
+def get_profile():
+    """ Get the profile for the run
+
+    Returns:
+        An ApiProfile object, or None if the profile is not enabled
+    """
+    return(_profile)
+
+
+def print_profile(summary):
+    """ Print the summary of a profile, after all the queued messages (see
+        messages.print_report)
+
+    Args:
+        summary: A dict returned by ApiProfile.summary
+    """
+    lines = ["%-14s %-30s %7s %7s %7s %9s %9s %9s %9s" % (
+        'REGION', 'ACTION', 'CALLS', 'ERRORS', 'RETRIES', 'TOTAL(s)',
+        'MEAN(s)', 'MAX(s)', 'WAIT(s)')]
+    for stats in summary['actions']:
+        lines.append("%-14s %-30s %7d %7d %7d %9.3f %9.4f %9.4f %9.3f" % (
+            stats['region'], stats['action'], stats['calls'],
+            stats['errors'], stats['retries'], stats['seconds'],
+            stats['mean_seconds'], stats['max_seconds'],
+            stats['rate_wait_seconds'] + stats['backoff_seconds']))
+    lines.append("Total: %s calls, %s retries, %s seconds in calls" % (
+        summary['calls'], summary['retries'], summary['seconds']))
+    for rtype, stats in sorted(summary['waits'].iteritems()):
+        lines.append("Waits for %s: %s waits, %s seconds waiting, %s polls "
+                     "for %s resources" % (rtype, stats['waits'],
+                                           stats['seconds'], stats['polls'],
+                                           stats['polled']))
+    print_report(lines)
+
+
+def finish_profile(profile, output=None):
+    """ Print the summary of a profile, and write it as JSON if requested
+
+    Args:
+        profile: An ApiProfile object
+        output: A string with the path of the JSON file for the summary
+                (optional)
+    """
+    summary = profile.summary()
+    print_profile(summary)
+    if output is not None:
+        with open(output, 'w') as outfile:
+            json.dump(summary, outfile, indent=2, sort_keys=True)
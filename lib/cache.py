@@ -0,0 +1,102 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from connection import ec2conn
+from copy import copy
+from functools import wraps
+from threading import Lock
+
+# Described resources, indexed by (resource type, region, resource id). The
+# cache lives for the whole run, and must be invalidated after any call
+# changing a resource
+_cache = {}
+_cache_lock = Lock()
+
+
+def _bind(resource, region):
+    """ Copy a cached resource for the calling thread
+
+        boto objects make their calls (for example, update) with the
+        connection that fetched them, and connections are kept per thread,
+        so the copy uses the connection of the calling thread
+
+    Args:
+        resource: The boto object for the resource
+        region: A string with the AWS region where the resource is
+    Returns:
+        A copy of the boto object
+    """
+    resource = copy(resource)
+    resource.connection = ec2conn(region)
+    return(resource)
+
+
+def cache_store(rtype, region, resource):
+    """ Store a described resource in the cache
+
+    Args:
+        rtype: A string with the resource type (instance|snapshot|volume)
+        region: A string with the AWS region where the resource is
+        resource: The boto object for the resource
+    """
+    with _cache_lock:
+        _cache[(rtype, region, resource.id)] = resource
+
+
+def cache_invalidate(rtype, region, resource_id):
+    """ Remove a resource from the cache, after changing it
+
+    Args:
+        rtype: A string with the resource type (instance|snapshot|volume)
+        region: A string with the AWS region where the resource is
+        resource_id: A string with the resource id
+    """
+    with _cache_lock:
+        _cache.pop((rtype, region, resource_id), None)
+
+
+def cache_clear():
+    """ Remove all the resources from the cache """
+    with _cache_lock:
+        _cache.clear()
+
+
+def memoize(rtype):
+    """ Decorator to cache the result of a function fetching a resource
+
+    Args:
+        rtype: A string with the resource type (instance|snapshot|volume)
+    Returns:
+        A decorator for functions with the arguments (resource_id, region)
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(resource_id, region):
+            key = (rtype, region, resource_id)
+            with _cache_lock:
+                resource = _cache.get(key)
+            if resource is not None:
+                return(_bind(resource, region))
+            resource = function(resource_id, region)
+            with _cache_lock:
+                _cache[key] = resource
+            return(resource)
+        return(wrapper)
+    return(decorator)
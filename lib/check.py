@@ -19,7 +19,12 @@
 
 
 from exceptions import OptInvalidBoolean, OptInvalidPosInteger
-from exceptions import OptInvalidPosIntegerBoolean
+from exceptions import OptInvalidPosIntegerBoolean, OptInvalidValue
+from messages import configure_messages, print_report
+
+# Accepted values for --log-level and --log-format
+LOG_LEVELS = ['info', 'warning', 'error']
+LOG_FORMATS = ['text', 'json']
 
 
 def posint_or_default(option, value, default=None):
@@ -118,6 +123,56 @@ def print_usage_error(script, error):
         Returns:
            Nothing
     """
-    print 'Usage: %s <arguments>' % script
-    print ''
-    print '%s: error: %s' % (script, error)
+    print_report(['Usage: %s <arguments>' % script, '',
+                  '%s: error: %s' % (script, error)])
+
+
+def add_output_options(parser):
+    """ Add the options for the messages and the API profile, common to all
+        the tools
+
+        Args:
+           parser: An optparse.OptionParser object
+        Returns:
+           Nothing
+    """
+    parser.add_option('--log-level', action='store',
+                      help='Minimum level of the messages to print'
+                           ' (info|warning|error) [Optional, default: info]')
+    parser.add_option('--log-format', action='store',
+                      help='Format of the messages (text|json) [Optional,'
+                           ' default: text]')
+    parser.add_option('--profile', action='store_false',
+                      help='When present, print a summary of the EC2 API'
+                           ' calls (count, latency, retries) and of the time'
+                           ' waiting for resources at exit')
+    parser.add_option('--profile-output', action='store',
+                      help='JSON file to write the summary of the EC2 API'
+                           ' calls to (implies --profile) [Optional]')
+
+
+def check_output_options(options):
+    """ Check the options added by add_output_options, set their defaults
+        and configure the messages with them
+
+        Args:
+           options: The options returned by optparse.OptionParser.parse_args
+        Returns:
+           Nothing
+        Raises:
+           OptInvalidValue: If --log-level or --log-format have an invalid
+                            value
+    """
+    if options.log_level is None:
+        options.log_level = 'info'
+    elif options.log_level not in LOG_LEVELS:
+        raise OptInvalidValue('log-level')
+    if options.log_format is None:
+        options.log_format = 'text'
+    elif options.log_format not in LOG_FORMATS:
+        raise OptInvalidValue('log-format')
+    configure_messages(options.log_level, options.log_format)
+    if options.profile is None and options.profile_output is None:
+        options.profile = False
+    else:
+        options.profile = True
@@ -19,9 +19,118 @@
 
 
 from boto import ec2
+from boto.ec2.connection import EC2Connection
+from contextlib import contextmanager
 from exceptions import EC2ConnectError
+from threading import Lock, local
+from throttle import throttled_call
+import os
 
-_ec2_connection = None
+# Environment variable with the path of a JSON file with the settings for the
+# EC2 simulator (see simulator.py). When set, no calls are made to AWS
+SIMULATOR_ENV = 'EBS_TOOLS_SIMULATOR'
+
+# EC2 API version for the calls and parameters that are missing from the
+# default API version of boto (2014-10-01): ModifyVolume,
+# DescribeVolumesModifications, TagSpecification for CreateSnapshot and the
+# pagination of DescribeSnapshots (MaxResults and NextToken)
+MODERN_API_VERSION = '2016-11-15'
+
+# Connections are kept per thread and per region, as boto connections are
+# not thread-safe. Each connection reuses its own keep-alive HTTP connections
+_ec2_connections = local()
+
+# Function creating the connection for a region, see set_connection_factory
+_factory = None
+_factory_lock = Lock()
+
+
+class ThrottledEC2Connection(EC2Connection):
+    """ EC2 connection that rate limits all the API calls, and retries them
+        when they are throttled (see throttle.py)
+    """
+
+    def get_list(self, action, *args, **kwargs):
+        parent = super(ThrottledEC2Connection, self).get_list
+        return(throttled_call(self.region.name, action, parent, action,
+                              *args, **kwargs))
+
+    def get_object(self, action, *args, **kwargs):
+        parent = super(ThrottledEC2Connection, self).get_object
+        return(throttled_call(self.region.name, action, parent, action,
+                              *args, **kwargs))
+
+    def get_status(self, action, *args, **kwargs):
+        parent = super(ThrottledEC2Connection, self).get_status
+        return(throttled_call(self.region.name, action, parent, action,
+                              *args, **kwargs))
+
+
+@contextmanager
+def api_version(conn, version):
+    """ Send the calls made with a connection inside the block with the given
+        EC2 API version
+
+        Connections are not shared between threads, so the version of the
+        connection can be changed for the block.
+
+    Args:
+        conn: A boto.ec2.connection.EC2Connection object
+        version: A string with the EC2 API version (for example, 2016-11-15)
+    """
+    previous = conn.APIVersion
+    conn.APIVersion = version
+    try:
+        yield conn
+    finally:
+        conn.APIVersion = previous
+
+
+def boto_connection(region):
+    """ Create a connection to the EC2 API with boto
+
+    Args:
+        region: The string for the AWS region to connect
+    Returns:
+        A ThrottledEC2Connection object
+    """
+    region_info = ec2.get_region(region)
+    # As per boto documentation
+    if region_info is None:
+        raise Exception('Region %s is invalid' % region)
+    return(ThrottledEC2Connection(region=region_info))
+
+
+def set_connection_factory(factory):
+    """ Replace the function creating the EC2 connections, for example with
+        an EC2 simulator (see simulator.py)
+
+    Args:
+        factory: A function receiving a string with the AWS region and
+                 returning an object with the boto EC2Connection interface,
+                 or None to connect to AWS with boto
+    """
+    global _factory
+    with _factory_lock:
+        _factory = factory
+
+
+def get_connection_factory():
+    """ Get the function creating the EC2 connections
+
+    Returns:
+        The function set with set_connection_factory, a simulator if the
+        EBS_TOOLS_SIMULATOR environment variable is set, or boto_connection
+    """
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            if os.environ.get(SIMULATOR_ENV):
+                from simulator import load_simulator
+                _factory = load_simulator(os.environ[SIMULATOR_ENV])
+            else:
+                _factory = boto_connection
+        return(_factory)
 
 
 def ec2conn(region):
@@ -30,17 +139,24 @@ def ec2conn(region):
     Args:
         region: The string for the AWS region to connect
     Returns:
-        A boto.ec2.connection.EC2Connection object with the connection
+        A boto.ec2.connection.EC2Connection object with the connection for
+        the current thread and region
     Raises:
         EC2Connect: If connection was not possible
     """
-    global _ec2_connection
-    if _ec2_connection is None:
+    try:
+        connections = _ec2_connections.pool
+    except AttributeError:
+        connections = _ec2_connections.pool = {}
+    try:
+        factory = get_connection_factory()
+    except Exception as e:
+        raise EC2ConnectError(e)
+    connection = connections.get((factory, region))
+    if connection is None:
         try:
-            _ec2_connection = ec2.connect_to_region(region)
-            # As per boto documentation
-            if _ec2_connection is None:
-                raise Exception('Region %s is invalid' % region)
+            connection = factory(region)
         except Exception as e:
             raise EC2ConnectError(e)
-    return _ec2_connection
+        connections[(factory, region)] = connection
+    return(connection)
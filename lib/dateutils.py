@@ -18,8 +18,23 @@
 # along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from calendar import timegm
 from datetime import datetime, timedelta
 
+# Format of the start times returned by EC2
+EC2_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
+
+# Maximum number of days kept at each cache of the time codec
+CACHE_SIZE = 100000
+
+_EPOCH_DAY = datetime(1970, 1, 1).toordinal()
+
+# Caches for the time codec: days since the epoch by date string, date
+# strings by days since the epoch, and (month, monthday) by ordinal day
+_days_by_date = {}
+_dates_by_day = {}
+_months_by_day = {}
+
 
 def timedelta_months(date, nmonths):
     """ Substract a number of days from a given date and then get then
@@ -35,12 +50,8 @@ def timedelta_months(date, nmonths):
            A datetime.date object with the first day of the month for then
            substraction
     """
-    first_day = datetime(date.year, date.month, 1)
-    for i in range(0, nmonths):
-        first_day = datetime(first_day.year, first_day.month, 1)
-        first_day = first_day - timedelta(days=1)
-        first_day = datetime(first_day.year, first_day.month, 1)
-    return(first_day)
+    months = date.year * 12 + date.month - 1 - nmonths
+    return(datetime(months // 12, months % 12 + 1, 1))
 
 
 def timedelta_to_strf(date, days=0, seconds=0, microseconds=0,
@@ -67,3 +78,76 @@ def timedelta_to_strf(date, days=0, seconds=0, microseconds=0,
         return diff.strftime('%Y-%m-%dT%H:%M:%S.000Z')
     else:
         return diff.strftime('%Y-%m-%dT%H:%M:%S.%z')
+
+
+def strf_to_epoch(string):
+    """ Convert a time string as returned by EC2 to seconds since the epoch
+
+        The date is parsed once per day and cached, and the time is parsed
+        by position. Strings not exactly in EC2_TIME_FORMAT are parsed with
+        strptime.
+
+        Args:
+           string: A string with the time (UTC), in EC2_TIME_FORMAT
+        Returns:
+           An integer with the seconds since the epoch
+        Raises:
+           ValueError: If the string is not in EC2_TIME_FORMAT
+    """
+    time = string[11:19]
+    if (len(string) == 24 and string[10] == 'T' and string[19:] == '.000Z'
+            and time[2] == ':' and time[5] == ':' and
+            (time[0:2] + time[3:5] + time[6:8]).isdigit()):
+        hour = int(time[0:2])
+        minute = int(time[3:5])
+        second = int(time[6:8])
+        if hour < 24 and minute < 60 and second < 60:
+            day = _days_by_date.get(string[0:10])
+            if day is None:
+                day = (datetime.strptime(string[0:10], '%Y-%m-%d').toordinal()
+                       - _EPOCH_DAY)
+                if len(_days_by_date) >= CACHE_SIZE:
+                    _days_by_date.clear()
+                _days_by_date[string[0:10]] = day
+            return(day * 86400 + hour * 3600 + minute * 60 + second)
+    return(timegm(datetime.strptime(string, EC2_TIME_FORMAT).timetuple()))
+
+
+def epoch_to_strf(epoch):
+    """ Convert seconds since the epoch to a time string as returned by EC2
+
+        The date is formatted once per day and cached.
+
+        Args:
+           epoch: An integer with the seconds since the epoch
+        Returns:
+           A string with the time (UTC), in EC2_TIME_FORMAT
+    """
+    day, seconds = divmod(epoch, 86400)
+    datestring = _dates_by_day.get(day)
+    if datestring is None:
+        date = datetime.fromordinal(day + _EPOCH_DAY)
+        datestring = '%04d-%02d-%02d' % (date.year, date.month, date.day)
+        if len(_dates_by_day) >= CACHE_SIZE:
+            _dates_by_day.clear()
+        _dates_by_day[day] = datestring
+    return('%sT%02d:%02d:%02d.000Z' % (datestring, seconds // 3600,
+                                       seconds // 60 % 60, seconds % 60))
+
+
+def ordinal_month(day):
+    """ Get the month and the day of the month for a day, cached
+
+        Args:
+           day: An integer with the proleptic Gregorian ordinal of the day
+        Returns:
+           A tuple (month, monthday), where month is year * 12 + month - 1
+    """
+    month = _months_by_day.get(day)
+    if month is None:
+        date = datetime.fromordinal(day)
+        month = (date.year * 12 + date.month - 1, date.day)
+        if len(_months_by_day) >= CACHE_SIZE:
+            _months_by_day.clear()
+        _months_by_day[day] = month
+    return(month)
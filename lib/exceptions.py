@@ -29,6 +29,17 @@ class EC2ConnectError(Exception):
     def __str__(self):
         return('Error connecting to EC2 API: %s' % self.error)
 
+
+class CreateTagsError(Exception):
+
+    def __init__(self, resource_ids, error):
+        self.resource_ids = resource_ids
+        self.error = error
+
+    def __str__(self):
+        return('Error creating tags for %s: %s'
+               % (', '.join(self.resource_ids), self.error))
+
 # Instance exceptions
 
 
@@ -100,6 +111,7 @@ class InstanceStartImpossible(Exception):
         return('It is not possible to start the instance %s with the state %s'
                % (self.instance_id, self.instance_state))
 
+
 # EBS snapshot exceptions
 
 
@@ -121,6 +133,17 @@ class SnapshotCreateError(Exception):
         return('Error creating EBS snapshot: %s' % self.error)
 
 
+class SnapshotDeleteError(Exception):
+
+    def __init__(self, snapshot_id, error):
+        self.snapshot_id = snapshot_id
+        self.error = error
+
+    def __str__(self):
+        return('Error deleting EBS snapshot %s: %s' % (self.snapshot_id,
+                                                       self.error))
+
+
 class SnapshotsFetchError(Exception):
 
     def __init__(self, error):
@@ -147,6 +170,22 @@ class InvalidSnapshot(Exception):
     def __str__(self):
         return('Snapshot %s does not exist' % self.snapshot_id)
 
+
+class InvalidRetentionPlan(Exception):
+
+    def __init__(self, path, error):
+        self.path = path
+        self.error = error
+
+    def __str__(self):
+        return('Invalid retention plan %s: %s' % (self.path, self.error))
+
+
+class NumPyNotAvailable(Exception):
+
+    def __str__(self):
+        return('NumPy is needed for the vectorised retention')
+
 # EBS volume exceptions
 
 
@@ -296,6 +335,27 @@ class ErrorCreatingVolume(Exception):
         return('Error creating volume: %s' % self.error)
 
 
+class ErrorModifyingVolume(Exception):
+
+    def __init__(self, volume_id, error):
+        self.volume_id = volume_id
+        self.error = error
+
+    def __str__(self):
+        return('Error modifying volume %s: %s' % (self.volume_id, self.error))
+
+
+class VolumeModificationUnavailable(Exception):
+
+    def __init__(self, volume_id, reason):
+        self.volume_id = volume_id
+        self.reason = reason
+
+    def __str__(self):
+        return('Volume %s can not be modified in place: %s'
+               % (self.volume_id, self.reason))
+
+
 class ErrorAllVolumesSameType(Exception):
 
     def __init__(self, vtype):
@@ -312,6 +372,18 @@ class ErrorAllVolumesSamePIOPS(Exception):
         return('You are trying to migrate all volumes to the same IOPS value'
                ' they already have')
 
+# Task exceptions
+
+
+class ParallelTasksFailed(Exception):
+
+    def __init__(self, failed, total):
+        self.failed = failed
+        self.total = total
+
+    def __str__(self):
+        return('%s of %s parallel tasks failed' % (self.failed, self.total))
+
 # Program argument exceptions
 
 
@@ -19,14 +19,20 @@
 
 
 from boto.exception import EC2ResponseError
+from cache import cache_invalidate, cache_store, memoize
 from connection import ec2conn
 from exceptions import ErrorStartingInstance, ErrorStoppingInstance
 from exceptions import InstanceFetchError, InstanceStartImpossible
 from exceptions import InstanceStopImpossible, InvalidInstance
 from exceptions import InvalidInstanceID
-from time import sleep
+from waiter import wait_for
 
+# All instance states but terminated
+INSTANCE_STATES = ['pending', 'running', 'shutting-down', 'stopping',
+                   'stopped']
 
+
+@memoize('instance')
 def get_instance_by_id(instance_id, region):
     """ Fetch ah instance object from its ID
 
@@ -41,7 +47,6 @@ def get_instance_by_id(instance_id, region):
     """
     conn = ec2conn(region)
     try:
-        instance = conn.get_only_instances(instance_ids=instance_id)[0]
         return(conn.get_only_instances(instance_ids=instance_id)[0])
     except EC2ResponseError as e:
         if 'InvalidInstanceID.NotFound' in e.body:
@@ -53,12 +58,42 @@ def get_instance_by_id(instance_id, region):
     raise InvalidInstance(instance_name)
 
 
+def get_instances_by_name(instance_names, region):
+    """ Fetch the instances with the given names (tag), filtering them at the
+        EC2 API
+
+    Args:
+        instance_names: A list of strings with the instance names (tag)
+        region: A string with the AWS region where the instances are
+    Returns:
+        A dict with the instance names as keys and
+        boto.ec2.instance.Instance objects as values
+    Raises:
+        InstanceFetchError: If there was an error fetching the instances
+    """
+    conn = ec2conn(region)
+    try:
+        instances = conn.get_only_instances(
+            filters={'tag:Name': list(instance_names),
+                     'instance-state-name': INSTANCE_STATES})
+    except Exception as e:
+        raise InstanceFetchError(e)
+    index = {}
+    for instance in instances:
+        # Filter values are wildcards, so check the exact name
+        name = instance.tags.get("Name")
+        if name in instance_names and name not in index:
+            cache_store('instance', region, instance)
+            index[name] = instance
+    return(index)
+
+
 def get_instance_by_name(instance_name, region):
-    """ Fetch ah instance object from its ID
+    """ Fetch ah instance object from its name
 
     Args:
-        instance_id: A string with the instance name (tag) for the instance
-                     to fetch
+        instance_name: A string with the instance name (tag) for the instance
+                       to fetch
         region: A string with the AWS region where the instance is
     Returns:
         A boto.ec2.instance.Instance object representing the instance
@@ -66,18 +101,11 @@ def get_instance_by_name(instance_name, region):
         InstanceFetchError: If there was an error fetching the instance
         InvalidInstance: If the instance does not exist
     """
-    conn = ec2conn(region)
-    try:
-        reservations = conn.get_all_instances()
-    except Exception as e:
-        raise InstanceFetchError(e)
-    for reservation in reservations:
-        for instance in reservation.instances:
-            if instance.tags:
-                if instance.tags.get("Name") == instance_name:
-                    if instance.state != "terminated":
-                        return(instance)
-    raise InvalidInstance(instance_name)
+    instance = get_instances_by_name([instance_name], region).get(
+        instance_name)
+    if instance is None:
+        raise InvalidInstance(instance_name)
+    return(instance)
 
 
 def get_instance_state(instance_id, region):
@@ -89,6 +117,8 @@ def get_instance_state(instance_id, region):
     Returns:
         A string with the instance's state
     """
+    # The state must be always fetched
+    cache_invalidate('instance', region, instance_id)
     return(get_instance_by_id(instance_id, region).state)
 
 
@@ -114,9 +144,9 @@ def stop_instance_and_wait(instance_id, region, dry):
         conn = ec2conn(region)
         try:
             conn.stop_instances(instance_id, dry_run=dry)
-            while instancestate != "stopped":
-                sleep(15)
-                instancestate = get_instance_state(instance_id, region)
+            cache_invalidate('instance', region, instance_id)
+            wait_for('instance', instance_id, region,
+                     lambda i: i is None or i.state == "stopped")
         except Exception as e:
             try:
                 if 'DryRun flag is set' in e.body:
@@ -150,9 +180,9 @@ def start_instance_and_wait(instance_id, region, dry):
         conn = ec2conn(region)
         try:
             conn.start_instances(instance_id, dry)
-            while instancestate != "running":
-                sleep(15)
-                instancestate = get_instance_state(instance_id, region)
+            cache_invalidate('instance', region, instance_id)
+            wait_for('instance', instance_id, region,
+                     lambda i: i is None or i.state == "running")
         except Exception as e:
             try:
                 if 'DryRun flag is set' in e.body:
@@ -18,6 +18,15 @@
 # along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from atexit import register
+from collections import deque
+from contextlib import contextmanager
+from threading import Event, Lock, Thread, local
+from time import time
+import json
+import sys
+
+
 class bcolors:
     BOLDRED = '\033[1;31m'
     BOLDGREEN = '\033[1;32m'
@@ -27,26 +36,241 @@ class bcolors:
     RESET = '\033[0m'
 
 
+# Levels for the messages, to filter them. Messages for successful actions
+# (ok) and section banners (special) are informational
+LEVELS = {
+    'info': 20,
+    'ok': 20,
+    'special': 20,
+    'warning': 30,
+    'error': 40,
+}
+
+# Label and colour for each kind of message, in text format
+STYLES = {
+    'error': ('[ERROR] ', bcolors.BOLDRED),
+    'warning': ('[WARNING] ', bcolors.BOLDYELLOW),
+    'ok': ('[OK] ', bcolors.BOLDGREEN),
+    'info': ('[INFO] ', bcolors.BOLDCYAN),
+    'special': ('', bcolors.BOLDPURPLE),
+}
+
+# Output formats: colour-coded text, or JSON Lines for machines
+FORMATS = ('text', 'json')
+
+# Maximum number of messages written with a single write
+MAX_BATCH = 1000
+
+_task = local()
+
+
+class LogSink(object):
+    """ Queue of messages written by a single thread, so the threads printing
+        messages are never blocked by the terminal, and the messages from
+        several threads are not interleaved
+
+    Properties:
+        level: A string with the minimum level of the messages to write
+               (see LEVELS)
+        fmt: A string with the output format (see FORMATS)
+        output: A file object to write the messages to
+    """
+
+    def __init__(self, level='info', fmt='text', output=None):
+        self.level = level
+        self.fmt = fmt
+        self.output = output
+        # Appending to a deque is thread-safe and does not need a lock
+        self.pending = deque()
+        # Set when there are new messages for the writer thread
+        self.wakeup = Event()
+        self.lock = Lock()
+        self.thread = None
+
+    def emit(self, kind, msg):
+        """ Queue a message
+
+        Args:
+            kind: A string with the kind of message (see LEVELS)
+            msg: The message
+        """
+        if LEVELS[kind] < LEVELS[self.level]:
+            return
+        self.pending.append((time(), kind, getattr(_task, 'prefix', None),
+                             "%s" % msg))
+        self._wake()
+
+    def _wake(self):
+        # Setting the event takes a lock, so it is only set when the writer
+        # may be waiting for it
+        if not self.wakeup.is_set():
+            self.wakeup.set()
+        if self.thread is None:
+            self._start()
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def format(self, timestamp, kind, task, msg):
+        """ Format a message for the output
+
+        Returns:
+            A string with the message encoded as UTF-8, including the line
+            break
+        """
+        if self.fmt == 'json':
+            if isinstance(msg, str):
+                # Byte strings that are not UTF-8 can not be dumped
+                msg = msg.decode('utf-8', 'replace')
+            line = json.dumps({'time': round(timestamp, 3), 'level': kind,
+                               'task': task, 'message': msg},
+                              sort_keys=True) + '\n'
+        else:
+            label, colour = STYLES[kind]
+            if task is not None:
+                label = "%s[%s] " % (label, task)
+            line = colour + label + msg + bcolors.RESET + '\n'
+        # Encode explicitly, as the output may not have an encoding (for
+        # example, when it is a pipe)
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        return(line)
+
+    def _run(self):
+        pending = self.pending
+        while True:
+            # The event is cleared before writing, so the messages queued
+            # while writing set it again
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while pending:
+                try:
+                    self._write_batch()
+                except Exception:
+                    # The thread must keep writing the next messages
+                    pass
+
+    def _write_batch(self):
+        # Write a batch of the pending messages, and then wake up the threads
+        # waiting for them (see flush)
+        pending = self.pending
+        messages = []
+        flushed = []
+        while pending and len(messages) < MAX_BATCH:
+            message = pending.popleft()
+            if isinstance(message, tuple):
+                messages.append(message)
+            else:
+                flushed.append(message)
+        try:
+            output = self.output or sys.stdout
+            output.write(''.join([self.format(*message)
+                                  for message in messages]))
+            output.flush()
+        except Exception as e:
+            # The messages are lost, but not silently
+            try:
+                sys.stderr.write("Error writing %s messages: %s\n"
+                                 % (len(messages), e))
+            except Exception:
+                pass
+        finally:
+            for event in flushed:
+                event.set()
+
+    def flush(self):
+        """ Wait until all the queued messages are written """
+        if self.thread is None:
+            return
+        event = Event()
+        self.pending.append(event)
+        self._wake()
+        # Wait with a timeout so the main thread can still be interrupted,
+        # and stop waiting if the writer thread is gone
+        while not event.wait(1):
+            if not self.thread.is_alive():
+                break
+
+
+_sink = LogSink()
+register(_sink.flush)
+
+
+def configure_messages(level='info', fmt='text'):
+    """ Configure the messages for the run
+
+    Args:
+        level: A string with the minimum level of the messages to print
+               (see LEVELS)
+        fmt: A string with the output format (text|json)
+    """
+    _sink.flush()
+    _sink.level = level
+    _sink.fmt = fmt
+
+
+def flush_messages():
+    """ Wait until all the queued messages are printed """
+    _sink.flush()
+
+
+def print_report(lines):
+    """ Print a report (for example, the profile summary) after all the
+        queued messages. With the json format it is printed to the standard
+        error, so the standard output has only JSON Lines
+
+    Args:
+        lines: A list of strings with the lines of the report
+    """
+    _sink.flush()
+    if _sink.fmt == 'json':
+        output = sys.stderr
+    else:
+        output = _sink.output or sys.stdout
+    output.write(''.join(["%s\n" % line for line in lines]))
+    output.flush()
+
+
+@contextmanager
+def task_prefix(prefix):
+    """ Add a prefix to the messages printed by the current thread, to
+        identify the task printing them
+
+    Args:
+        prefix: A string with the prefix (for example, a volume-id)
+    """
+    previous = getattr(_task, 'prefix', None)
+    _task.prefix = prefix
+    try:
+        yield
+    finally:
+        _task.prefix = previous
+
+
 def print_error(msg):
     """ Print an error message in red """
-    print bcolors.BOLDRED + "[ERROR] %s" % msg + bcolors.RESET
+    _sink.emit('error', msg)
 
 
 def print_warning(msg):
     """ Print a warning message in yellow """
-    print bcolors.BOLDYELLOW + "[WARNING] %s" % msg + bcolors.RESET
+    _sink.emit('warning', msg)
 
 
 def print_ok(msg):
     """ Print an ok message in green """
-    print bcolors.BOLDGREEN + "[OK] %s" % msg + bcolors.RESET
+    _sink.emit('ok', msg)
 
 
 def print_info(msg):
     """ Print an info message in cyan """
-    print bcolors.BOLDCYAN + "[INFO] %s" % msg + bcolors.RESET
+    _sink.emit('info', msg)
 
 
 def print_special(msg):
     """ Print an info message in cyan """
-    print bcolors.BOLDPURPLE + "%s" % msg + bcolors.RESET
+    _sink.emit('special', msg)
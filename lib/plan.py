@@ -0,0 +1,121 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from dateutils import strf_to_epoch
+from exceptions import InvalidRetentionPlan
+from retention import SnapshotRecord
+import json
+
+# Version of the plan file format
+PLAN_VERSION = 1
+
+
+class RetentionPlan(object):
+    """ Retention computed for the snapshots of a set of volumes, so it can
+        be reviewed and executed later without listing the snapshots again
+
+        A plan is saved as JSON Lines: a header line with the plan
+        properties, and then a line per snapshot with its volume_id,
+        snapshot_id, start_time and type (None if the snapshot is to be
+        deleted)
+
+    Properties:
+        region: A string with the AWS region where the snapshots are
+        policy: A dict with the hourly, daily, weekly and monthly backups
+        test: A boolean stating if the snapshots are not real
+        volumes: A list of tuples (volume_id, snapshots), where snapshots is
+                 a list of retention.SnapshotRecord objects
+    """
+
+    def __init__(self, region, policy, test=False):
+        self.region = region
+        self.policy = policy
+        self.test = test
+        self.volumes = []
+
+    def add(self, volume_id, snapshots):
+        """ Add the retention for the snapshots of a volume
+
+        Args:
+            volume_id: A string with the EBS volume-id
+            snapshots: A list of retention.SnapshotRecord objects, as
+                       returned by retention.classify_snapshots
+        """
+        self.volumes.append((volume_id, snapshots))
+
+    def deletions(self):
+        """ Return the number of snapshots to delete """
+        return(sum([len([s for s in snapshots if s.type is None])
+                    for volume_id, snapshots in self.volumes]))
+
+    def write(self, path):
+        """ Write the plan to a file
+
+        Args:
+            path: A string with the path for the file
+        """
+        with open(path, 'w') as planfile:
+            planfile.write("%s\n" % json.dumps(
+                {'version': PLAN_VERSION, 'region': self.region,
+                 'policy': self.policy, 'test': self.test},
+                sort_keys=True))
+            for volume_id, snapshots in self.volumes:
+                for snapshot in snapshots:
+                    planfile.write("%s\n" % json.dumps(
+                        {'volume_id': volume_id,
+                         'snapshot_id': snapshot.id,
+                         'start_time': snapshot.start_time,
+                         'type': snapshot.type}, sort_keys=True))
+
+
+def read_plan(path):
+    """ Read a plan written by RetentionPlan.write
+
+    Args:
+        path: A string with the path for the file
+    Returns:
+        A RetentionPlan object
+    Raises:
+        InvalidRetentionPlan: If the file could not be read or is not a plan
+    """
+    try:
+        with open(path) as planfile:
+            header = json.loads(planfile.readline())
+            if header.get('version') != PLAN_VERSION:
+                raise InvalidRetentionPlan(path, 'unknown version %s'
+                                           % header.get('version'))
+            plan = RetentionPlan(header['region'], header['policy'],
+                                 header['test'])
+            volumes = {}
+            for line in planfile:
+                record = json.loads(line)
+                volume_id = record['volume_id']
+                if volume_id not in volumes:
+                    volumes[volume_id] = []
+                    plan.add(volume_id, volumes[volume_id])
+                volumes[volume_id].append(
+                    SnapshotRecord(record['snapshot_id'],
+                                   strf_to_epoch(record['start_time']),
+                                   record['type']))
+    except InvalidRetentionPlan:
+        raise
+    except Exception as e:
+        raise InvalidRetentionPlan(path, e)
+    return(plan)
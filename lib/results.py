@@ -0,0 +1,130 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from contextlib import contextmanager
+from dateutils import epoch_to_strf
+from threading import Lock
+from time import time
+import json
+
+
+class ResultStream(object):
+    """ Stream of results written as JSON Lines, one record for each snapshot
+        saved, deleted or created, as soon as it happens. Records are not
+        kept, so the memory used does not depend on the number of results
+
+    Properties:
+        path: A string with the path of the file
+        counts: A dict with the number of records for each event
+        errors: An integer with the number of records with errors
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.counts = {}
+        self.errors = 0
+        self.lock = Lock()
+        self.outfile = open(path, 'w')
+
+    def write(self, event, **fields):
+        """ Write a record
+
+        Args:
+            event: A string with the event (saved|deleted|created)
+            **fields: The fields for the record
+        """
+        fields['event'] = event
+        fields['time'] = epoch_to_strf(int(time()))
+        line = json.dumps(fields, sort_keys=True)
+        with self.lock:
+            self.outfile.write(line + '\n')
+            # Each record is available to consumers at once
+            self.outfile.flush()
+            self.counts[event] = self.counts.get(event, 0) + 1
+            if fields.get('error') is not None:
+                self.errors += 1
+
+    def snapshot_saved(self, volume_id, snapshot):
+        """ Write the record for a snapshot saved by the retention
+
+        Args:
+            volume_id: A string with the EBS volume-id
+            snapshot: A retention.SnapshotRecord object
+        """
+        self.write('saved', volume_id=volume_id, snapshot_id=snapshot.id,
+                   start_time=snapshot.start_time, type=snapshot.type)
+
+    def snapshot_deleted(self, volume_id, snapshot, dry):
+        """ Write the record for a snapshot deleted by the retention
+
+        Args:
+            volume_id: A string with the EBS volume-id
+            snapshot: A retention.SnapshotRecord object, after the deletion
+            dry: A boolean stating if the action was simulated or not
+        """
+        error = None
+        if snapshot.error is not None:
+            error = str(snapshot.error)
+        self.write('deleted', volume_id=volume_id, snapshot_id=snapshot.id,
+                   start_time=snapshot.start_time, dry=dry, error=error)
+
+    def snapshot_created(self, volume_id, snapshot, dry, description=None):
+        """ Write the record for a new snapshot
+
+        Args:
+            volume_id: A string with the EBS volume-id
+            snapshot: A boto.ec2.snapshot.Snapshot object, or None for a dry
+                      run
+            dry: A boolean stating if the action was simulated or not
+            description: A string with the description requested for the
+                         snapshot (only used for dry runs)
+        """
+        if snapshot is None:
+            self.write('created', volume_id=volume_id, snapshot_id=None,
+                       start_time=None, dry=dry, description=description)
+        else:
+            self.write('created', volume_id=volume_id,
+                       snapshot_id=snapshot.id,
+                       start_time=snapshot.start_time, dry=dry,
+                       description=snapshot.description)
+
+    def close(self):
+        with self.lock:
+            self.outfile.close()
+
+
+@contextmanager
+def open_results(path):
+    """ Open a results stream for a with block
+
+    Args:
+        path: A string with the path of the file, or None
+    Returns:
+        A context manager for a ResultStream object, or for None if path is
+        None
+    """
+    if path is None:
+        yield None
+        return
+    results = ResultStream(path)
+    try:
+        yield results
+    finally:
+        results.close()
@@ -0,0 +1,222 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from datetime import datetime
+from dateutils import epoch_to_strf, ordinal_month
+from operator import attrgetter
+
+# There are no snapshots older than 1/1/2006 (year when AWS started working)
+OLDEST_SNAPSHOT_DATE = datetime(2006, 1, 1)
+
+# Minimum number of snapshots to use the NumPy backend (if available)
+VECTORISED_MIN_SNAPSHOTS = 10000
+
+_EPOCH_DAY = datetime(1970, 1, 1).toordinal()
+_OLDEST_DAY = OLDEST_SNAPSHOT_DATE.toordinal()
+_OLDEST_HOUR = _OLDEST_DAY * 24
+_OLDEST_MONTH = OLDEST_SNAPSHOT_DATE.year * 12 + OLDEST_SNAPSHOT_DATE.month - 1
+
+
+class SnapshotRecord(object):
+    """ Compact record for a snapshot, used for listing, retention and
+        reporting
+
+    Properties:
+        id: A string with the snapshot id
+        start: An integer with the start time, in seconds since the epoch
+        type: A string with the retention type (hourly, daily, weekly or
+              monthly), or None if the snapshot is not to be saved
+        error: The error deleting the snapshot, or None
+    """
+    __slots__ = ('id', 'start', 'type', 'error')
+
+    def __init__(self, id, start, type=None, error=None):
+        self.id = id
+        self.start = start
+        self.type = type
+        self.error = error
+
+    @property
+    def start_time(self):
+        """ The start time as a string, as returned by EC2 """
+        return(epoch_to_strf(self.start))
+
+
+def bucket_keys(date):
+    """ Compute the retention bucket keys for a snapshot date
+
+        Args:
+            date: A datetime object with the start time of the snapshot
+        Returns:
+            A tuple (hour, day, weekday, monthday, month, timed) where hour,
+            day and month are integers identifying the hour, day and month
+            buckets, weekday and monthday are the day of the week (Monday is
+            0) and the day of the month, and timed is True if the date is not
+            exactly midnight
+    """
+    day = date.toordinal()
+    return((day * 24 + date.hour, day, date.weekday(), date.day,
+            date.year * 12 + date.month - 1,
+            bool(date.hour or date.minute or date.second or
+                 date.microsecond)))
+
+
+def epoch_bucket_keys(start):
+    """ Compute the retention bucket keys for a snapshot start time, as
+        bucket_keys does
+
+        Args:
+            start: An integer with the start time, in seconds since the epoch
+        Returns:
+            A tuple as returned by bucket_keys
+    """
+    seconds = start % 86400
+    day = start // 86400 + _EPOCH_DAY
+    month, monthday = ordinal_month(day)
+    return((day * 24 + seconds // 3600, day, (day + 6) % 7, monthday, month,
+            seconds != 0))
+
+
+def classify_keys(keys, hourly_backups, daily_backups, weekly_backups,
+                  monthly_backups, now):
+    """ Assign a retention type to a list of snapshot bucket keys
+
+        Snapshots are processed from the newest to the oldest and the newest
+        snapshot for every hour, day, sunday or first day of month is kept
+        until there are enough backups of each type. Every phase starts once
+        the previous one has all its backups.
+
+        Args:
+            keys: A list of tuples as returned by bucket_keys, sorted by
+                  snapshot start time (descending)
+            hourly_backups: An integer with the number of hourly backups to
+                            save
+            daily_backups: An integer with the number of daily backups to save
+            weekly_backups: An integer with the number of weekly backups to
+                            save
+            monthly_backups: An integer with the number of monthly backups to
+                             save, or True to save all monthly backups, or
+                             False to delete all monthly backups.
+            now: A datetime object with the reference date (UTC)
+        Returns:
+            A list with the retention type (hourly, daily, weekly or monthly)
+            for each key, in the same order, or None if the snapshot is not
+            to be saved
+    """
+    today = now.toordinal()
+    # Most recent buckets for each kind of backup
+    last_hour = today * 24 + now.hour
+    last_midnight = today
+    last_sunday = today - (now.weekday() + 1) % 7
+    last_sunday_timed = False
+    last_first = now.year * 12 + now.month - 1
+
+    # No hours, days, weeks or months found so far
+    find_hours = 0
+    find_days = 0
+    find_weeks = 0
+    find_months = 0
+
+    types = []
+    for hour, day, weekday, monthday, month, timed in keys:
+        stype = None
+        if find_hours < hourly_backups:
+            if _OLDEST_HOUR < hour <= last_hour:
+                stype = 'hourly'
+                find_hours += 1
+                # To ignore more backups for the hour, jump to the previous
+                # hour
+                last_hour = hour - 1
+        elif find_days < daily_backups:
+            if _OLDEST_DAY < day <= last_midnight:
+                stype = 'daily'
+                find_days += 1
+                # Weekly backups start at the sunday before this snapshot
+                last_sunday = day - ((weekday + 1) % 7 or 7)
+                last_sunday_timed = timed
+                # To ignore more backups for the day, jump to the previous
+                # midnight
+                last_midnight = day - 1
+        elif find_weeks < weekly_backups:
+            if (day <= last_sunday and (last_sunday - day) % 7 == 0 and
+                    (day > _OLDEST_DAY or
+                     (day == _OLDEST_DAY and last_sunday_timed))):
+                stype = 'weekly'
+                find_weeks += 1
+                # Monthly backups start at the first day of month before this
+                # snapshot
+                last_first = month
+                if monthday == 1:
+                    last_first -= 1
+                # To ignore more backups for the week, jump to the previous
+                # sunday
+                last_sunday = day - 7
+        elif (find_months < monthly_backups) or monthly_backups is True:
+            if monthday == 1 and _OLDEST_MONTH < month <= last_first:
+                stype = 'monthly'
+                find_months += 1
+                # To ignore more backups for the month, jump to the previous
+                # month start
+                last_first = month - 1
+        types.append(stype)
+    return(types)
+
+
+def classify_snapshots(snapshots, hourly_backups, daily_backups,
+                       weekly_backups, monthly_backups, now):
+    """ Compute the retention for a list of snapshots, without any call to
+        AWS
+
+        Args:
+            snapshots: A list of SnapshotRecord objects, their type is set to
+                       the retention type
+            hourly_backups: An integer with the number of hourly backups to
+                            save
+            daily_backups: An integer with the number of daily backups to save
+            weekly_backups: An integer with the number of weekly backups to
+                            save
+            monthly_backups: An integer with the number of monthly backups to
+                             save, or True to save all monthly backups, or
+                             False to delete all monthly backups.
+            now: A datetime object with the reference date (UTC)
+        Returns:
+            A list with the SnapshotRecord objects sorted by start time
+            (descending). If type is None, the snapshot is not to be saved
+    """
+    # Sort snapshots by date and time (descending)
+    snapshots = sorted(snapshots, key=attrgetter('start'), reverse=True)
+    import retention_numpy
+    if (len(snapshots) >= VECTORISED_MIN_SNAPSHOTS and
+            retention_numpy.numpy_available()):
+        times = retention_numpy.epoch_start_times(
+            [snapshot.start for snapshot in snapshots])
+        types = [retention_numpy.RETENTION_TYPES[code] for code in
+                 retention_numpy.classify_start_times(times, hourly_backups,
+                                                      daily_backups,
+                                                      weekly_backups,
+                                                      monthly_backups, now)]
+    else:
+        # Compute the retention buckets once per snapshot and classify them
+        keys = [epoch_bucket_keys(snapshot.start) for snapshot in snapshots]
+        types = classify_keys(keys, hourly_backups, daily_backups,
+                              weekly_backups, monthly_backups, now)
+    for snapshot, stype in zip(snapshots, types):
+        snapshot.type = stype
+    return(snapshots)
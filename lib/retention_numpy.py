@@ -0,0 +1,215 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from datetime import datetime
+from exceptions import NumPyNotAvailable
+from retention import OLDEST_SNAPSHOT_DATE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Retention types for the codes returned by classify_start_times
+RETENTION_TYPES = (None, 'hourly', 'daily', 'weekly', 'monthly')
+HOURLY = 1
+DAILY = 2
+WEEKLY = 3
+MONTHLY = 4
+
+_EPOCH_DAY = datetime(1970, 1, 1).toordinal()
+_OLDEST_DAY = OLDEST_SNAPSHOT_DATE.toordinal()
+_OLDEST_HOUR = _OLDEST_DAY * 24
+_OLDEST_MONTH = OLDEST_SNAPSHOT_DATE.year * 12 + OLDEST_SNAPSHOT_DATE.month - 1
+
+
+def numpy_available():
+    """ Return True if NumPy can be used for the retention """
+    return(numpy is not None)
+
+
+def _check_numpy():
+    if numpy is None:
+        raise NumPyNotAvailable()
+
+
+def epoch_start_times(starts):
+    """ Convert snapshot start times in seconds since the epoch to an array
+
+        Args:
+            starts: A list of integers with the start times
+        Returns:
+            A numpy array of datetime64 (seconds)
+        Raises:
+            NumPyNotAvailable: If NumPy is not installed
+    """
+    _check_numpy()
+    return(numpy.array(starts, dtype='int64').astype('datetime64[s]'))
+
+
+def test_start_times(total, now):
+    """ Create the start times of create_test_snapshot_objects as an array
+
+        Args:
+            total: number of days with testing snapshots
+            now: A datetime object with the reference date (UTC)
+        Returns:
+            A numpy array of datetime64 (seconds) with total*3 start times
+        Raises:
+            NumPyNotAvailable: If NumPy is not installed
+    """
+    _check_numpy()
+    now = numpy.datetime64(now.replace(microsecond=0), 's')
+    days = numpy.arange(total, dtype='int64').repeat(3) * 86400
+    minutes = numpy.tile(numpy.array([0, 30, 120], dtype='int64') * 60,
+                         total)
+    return(now - (days + minutes).astype('timedelta64[s]'))
+
+
+def bucket_arrays(times):
+    """ Compute the retention bucket keys for an array of start times, as
+        retention.bucket_keys does for a single date
+
+        Args:
+            times: A numpy array of datetime64 (seconds)
+        Returns:
+            A tuple of numpy arrays (hour, day, weekday, monthday, month,
+            timed)
+    """
+    seconds = times.astype('int64')
+    day = seconds // 86400 + _EPOCH_DAY
+    hour = day * 24 + (seconds % 86400) // 3600
+    months = times.astype('datetime64[M]')
+    monthday = (times.astype('datetime64[D]') -
+                months.astype('datetime64[D]')).astype('int64') + 1
+    month = months.astype('int64') + 1970 * 12
+    return((hour, day, (day + 6) % 7, monthday, month, seconds % 86400 != 0))
+
+
+def _select(keys, candidates, start, wanted):
+    """ Select the newest snapshot for every distinct key, from the candidates
+        starting at an index
+
+        Returns:
+            A tuple (selected, end), with the array of selected indexes and
+            the index where the next phase starts (None if there are not
+            enough snapshots for the phase)
+    """
+    indexes = numpy.nonzero(candidates[start:])[0] + start
+    selected_keys = keys[indexes]
+    first = numpy.ones(len(indexes), dtype=bool)
+    first[1:] = selected_keys[1:] != selected_keys[:-1]
+    selected = indexes[first]
+    if wanted is True:
+        return((selected, None))
+    selected = selected[:wanted]
+    if len(selected) < wanted:
+        return((selected, None))
+    return((selected, selected[-1] + 1))
+
+
+def classify_start_times(times, hourly_backups, daily_backups,
+                         weekly_backups, monthly_backups, now):
+    """ Assign a retention type to an array of start times, with the same
+        result as retention.classify_keys but processing every phase as
+        array operations
+
+        Args:
+            times: A numpy array of datetime64 (seconds), in any order
+            hourly_backups: An integer with the number of hourly backups to
+                            save
+            daily_backups: An integer with the number of daily backups to save
+            weekly_backups: An integer with the number of weekly backups to
+                            save
+            monthly_backups: An integer with the number of monthly backups to
+                             save, or True to save all monthly backups, or
+                             False to delete all monthly backups.
+            now: A datetime object with the reference date (UTC)
+        Returns:
+            A numpy array of integers with the retention type for each start
+            time, in the same order (see RETENTION_TYPES, 0 if the snapshot
+            is not to be saved)
+        Raises:
+            NumPyNotAvailable: If NumPy is not installed
+    """
+    _check_numpy()
+    # Newest first, keeping the order of equal times as sorted() does
+    order = numpy.argsort(-times.astype('int64'), kind='mergesort')
+    hour, day, weekday, monthday, month, timed = bucket_arrays(times[order])
+    codes = numpy.zeros(len(order), dtype='int8')
+
+    today = now.toordinal()
+    start = 0
+    if hourly_backups > 0:
+        selected, start = _select(hour, (hour > _OLDEST_HOUR) &
+                                  (hour <= today * 24 + now.hour),
+                                  start, hourly_backups)
+        codes[selected] = HOURLY
+    last_sunday = today - (now.weekday() + 1) % 7
+    last_sunday_timed = False
+    if start is not None and daily_backups > 0:
+        selected, start = _select(day, (day > _OLDEST_DAY) & (day <= today),
+                                  start, daily_backups)
+        codes[selected] = DAILY
+        if start is not None:
+            # Weekly backups start at the sunday before the last daily
+            last = selected[-1]
+            last_sunday = day[last] - ((weekday[last] + 1) % 7 or 7)
+            last_sunday_timed = timed[last]
+    last_first = now.year * 12 + now.month - 1
+    if start is not None and weekly_backups > 0:
+        oldest = day > _OLDEST_DAY
+        if last_sunday_timed:
+            oldest |= day == _OLDEST_DAY
+        selected, start = _select(day, (day <= last_sunday) &
+                                  ((last_sunday - day) % 7 == 0) & oldest,
+                                  start, weekly_backups)
+        codes[selected] = WEEKLY
+        if start is not None:
+            # Monthly backups start at the first day of month before the
+            # last weekly
+            last = selected[-1]
+            last_first = month[last] - (monthday[last] == 1)
+    if (start is not None and
+            (monthly_backups is True or monthly_backups > 0)):
+        selected, start = _select(month, (monthday == 1) &
+                                  (month > _OLDEST_MONTH) &
+                                  (month <= last_first),
+                                  start, monthly_backups)
+        codes[selected] = MONTHLY
+
+    result = numpy.empty_like(codes)
+    result[order] = codes
+    return(result)
+
+
+def keep_mask(times, hourly_backups, daily_backups, weekly_backups,
+              monthly_backups, now):
+    """ Compute which snapshots are saved by a retention policy
+
+        Args:
+            See classify_start_times
+        Returns:
+            A numpy array of booleans, True for the snapshots to save
+        Raises:
+            NumPyNotAvailable: If NumPy is not installed
+    """
+    return(classify_start_times(times, hourly_backups, daily_backups,
+                                weekly_backups, monthly_backups, now) > 0)
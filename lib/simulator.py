@@ -0,0 +1,746 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from boto.exception import EC2ResponseError
+from dateutils import epoch_to_strf
+from random import Random
+from threading import Lock
+from throttle import throttled_call
+from time import sleep, time
+from workload import Workload
+import json
+
+# Default settings for the simulator, see load_simulator
+DEFAULT_CONFIG = {
+    # Seconds for every API call, and for specific API actions
+    'latency': 0.05,
+    'latencies': {},
+    # Probability of an API call being throttled
+    'throttle_rate': 0.0,
+    # Seconds for the state transitions of instances, volumes and volume
+    # modifications (for example, from stopping to stopped)
+    'transition_seconds': 1.0,
+    # Snapshot speed (GB per second) and probability of a snapshot failing
+    'snapshot_gb_per_second': 50.0,
+    'snapshot_failure_rate': 0.0,
+    # Maximum number of snapshots per DescribeSnapshots call
+    'max_results': 1000,
+    'seed': 0,
+    # Instances in every region, with their volumes
+    'instances': [],
+    # Settings for workload.Workload, to create snapshots for the volumes
+    'workload': None,
+}
+
+# Default EC2 API version of boto, and API version needed for the actions
+# and parameters that are missing from it
+DEFAULT_API_VERSION = '2014-10-01'
+ACTION_API_VERSIONS = {
+    'DescribeVolumesModifications': '2016-11-15',
+    'ModifyVolume': '2016-11-15',
+}
+PARAMETER_API_VERSIONS = {
+    'MaxResults': '2016-11-15',
+    'NextToken': '2016-11-15',
+    'TagSpecification': '2016-11-15',
+}
+
+_ERROR_BODY = ('<Response><Errors><Error><Code>%s</Code><Message>%s</Message>'
+               '</Error></Errors><RequestID>simulator</RequestID></Response>')
+
+_simulators = {}
+_simulators_lock = Lock()
+
+
+def ec2_error(status, code, message):
+    """ Build an error as returned by the EC2 API
+
+    Args:
+        status: An integer with the HTTP status
+        code: A string with the EC2 error code
+        message: A string with the error message
+    Returns:
+        A boto.exception.EC2ResponseError object
+    """
+    return(EC2ResponseError(status, code, _ERROR_BODY % (code, message)))
+
+
+def as_list(ids):
+    """ Return a list of ids from a string or a list """
+    if ids is None:
+        return(None)
+    if isinstance(ids, basestring):
+        return([ids])
+    return(list(ids))
+
+
+class SimulatedRegion(object):
+    """ Name of a simulated region, as boto.regioninfo.RegionInfo """
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Transitions(object):
+    """ Base for simulated resources, with attribute changes scheduled at a
+        given time and applied when the resource is read
+    """
+
+    # Prefix for the representation of the resource, as in boto
+    kind = None
+
+    def __repr__(self):
+        return('%s:%s' % (self.kind, self.id))
+
+    def schedule(self, at, **changes):
+        self.__dict__.setdefault('_transitions', []).append((at, changes))
+
+    def update_state(self, now):
+        transitions = self.__dict__.get('_transitions')
+        while transitions and transitions[0][0] <= now:
+            at, changes = transitions.pop(0)
+            for name, value in changes.iteritems():
+                if callable(value):
+                    value(self)
+                else:
+                    setattr(self, name, value)
+
+    def copy(self):
+        """ Return a copy of the resource, as a Describe call would """
+        resource = self.__class__.__new__(self.__class__)
+        for name, value in self.__dict__.iteritems():
+            if name == '_transitions':
+                continue
+            if isinstance(value, dict):
+                value = dict(value)
+            elif isinstance(value, Transitions):
+                value = value.copy()
+            resource.__dict__[name] = value
+        return(resource)
+
+
+class SimulatedAttachment(Transitions):
+    """ Attachment of a simulated volume, as boto.ec2.volume.AttachmentSet """
+
+    kind = 'AttachmentSet'
+
+    def __init__(self, instance_id=None, device=None, status=None):
+        self.id = None
+        self.instance_id = instance_id
+        self.device = device
+        self.status = status
+
+
+class SimulatedInstance(Transitions):
+    """ Simulated EC2 instance, as boto.ec2.instance.Instance """
+
+    kind = 'Instance'
+
+    def __init__(self, id, name, state, zone):
+        self.id = id
+        self.state = state
+        self.placement = zone
+        self.tags = {'Name': name}
+
+
+class SimulatedVolume(Transitions):
+    """ Simulated EBS volume, as boto.ec2.volume.Volume """
+
+    kind = 'Volume'
+
+    def __init__(self, id, region, size, vtype, iops, zone, encrypted=False,
+                 snapshot_id=None, status='available', tags=None):
+        self.id = id
+        self.region = region
+        self.size = size
+        self.type = vtype
+        self.iops = iops
+        self.zone = zone
+        self.encrypted = encrypted
+        self.snapshot_id = snapshot_id
+        self.status = status
+        self.tags = tags or {}
+        self.attach_data = SimulatedAttachment()
+
+
+class SimulatedSnapshot(Transitions):
+    """ Simulated EBS snapshot, as boto.ec2.snapshot.Snapshot """
+
+    kind = 'Snapshot'
+
+    def __init__(self, id, volume_id, volume_size, start_time, status,
+                 description='', encrypted=False, tags=None):
+        self.id = id
+        self.volume_id = volume_id
+        self.volume_size = volume_size
+        self.start_time = start_time
+        self.status = status
+        self.progress = '100%' if status == 'completed' else '0%'
+        self.description = description
+        self.encrypted = encrypted
+        self.owner_id = 'self'
+        self.tags = tags or {}
+
+
+class SimulatedModification(Transitions):
+    """ Simulated volume modification, as volumes.VolumeModification """
+
+    kind = 'VolumeModification'
+
+    def __init__(self, volume_id, target_type, target_iops):
+        self.id = volume_id
+        self.state = 'modifying'
+        self.progress = 0
+        self.target_type = target_type
+        self.target_iops = target_iops
+        self.status_message = None
+
+
+class SimulatedResultSet(list):
+    """ Result of a paginated call, as boto.resultset.ResultSet """
+    next_token = None
+
+
+class SimulatedEC2(object):
+    """ In-memory state of the EC2 resources of a simulated region
+
+    Properties:
+        region: A string with the region name
+        config: A dict with the simulator settings (see DEFAULT_CONFIG)
+    """
+
+    def __init__(self, region, config):
+        self.region = region
+        self.config = config
+        self.lock = Lock()
+        self.random = Random(config['seed'])
+        self.instances = {}
+        self.volumes = {}
+        self.snapshots = {}
+        self.snapshots_by_volume = {}
+        self.modifications = {}
+        self.counter = 0
+        workload = None
+        if config['workload'] is not None:
+            workload = Workload(**config['workload'])
+        vindex = 0
+        for iindex, definition in enumerate(config['instances']):
+            instance_id = 'i-%017x' % iindex
+            zone = definition.get('zone', '%sa' % region)
+            self.instances[instance_id] = SimulatedInstance(
+                instance_id, definition.get('name', instance_id),
+                definition.get('state', 'running'), zone)
+            for vdefinition in definition.get('volumes', []):
+                volume = SimulatedVolume('vol-%017x' % vindex, region,
+                                         vdefinition.get('size', 100),
+                                         vdefinition.get('type', 'gp2'),
+                                         vdefinition.get('iops'), zone,
+                                         vdefinition.get('encrypted', False),
+                                         status='in-use',
+                                         tags=dict(vdefinition.get('tags',
+                                                                   {})))
+                if 'name' in vdefinition:
+                    volume.tags['Name'] = vdefinition['name']
+                volume.attach_data = SimulatedAttachment(
+                    instance_id, vdefinition['device'], 'attached')
+                self.volumes[volume.id] = volume
+                if workload is not None:
+                    for record in workload.iter_snapshots(vindex):
+                        self.add_snapshot(SimulatedSnapshot(
+                            record.id, volume.id, volume.size,
+                            epoch_to_strf(record.start), 'completed',
+                            encrypted=volume.encrypted))
+                vindex += 1
+
+    def new_id(self, prefix):
+        self.counter += 1
+        return('%s-f%016x' % (prefix, self.counter))
+
+    def add_snapshot(self, snapshot):
+        self.snapshots[snapshot.id] = snapshot
+        self.snapshots_by_volume.setdefault(snapshot.volume_id,
+                                            []).append(snapshot.id)
+
+    def get(self, resources, resource_id, code):
+        resource = resources.get(resource_id)
+        if resource is None:
+            raise ec2_error(400, code, "The resource '%s' does not exist"
+                            % resource_id)
+        resource.update_state(time())
+        return(resource)
+
+    def later(self, seconds=None):
+        if seconds is None:
+            seconds = self.config['transition_seconds']
+        return(time() + seconds)
+
+
+def _filter_values(filters, name):
+    values = filters.get(name)
+    if values is None:
+        return(None)
+    return(set(as_list(values)))
+
+
+def parse_filter_params(params):
+    """ Get the filters from the params built by build_filter_params
+
+    Args:
+        params: A dict with the API call params
+    Returns:
+        A dict with filter names as keys and lists of values as values
+    """
+    filters = {}
+    i = 1
+    while 'Filter.%s.Name' % i in params:
+        values = []
+        j = 1
+        while 'Filter.%s.Value.%s' % (i, j) in params:
+            values.append(params['Filter.%s.Value.%s' % (i, j)])
+            j += 1
+        filters[params['Filter.%s.Name' % i]] = values
+        i += 1
+    return(filters)
+
+
+def parse_tag_specification(params):
+    """ Get the tags from the TagSpecification params of a call """
+    tags = {}
+    i = 1
+    while 'TagSpecification.1.Tag.%s.Key' % i in params:
+        tags[params['TagSpecification.1.Tag.%s.Key' % i]] = (
+            params['TagSpecification.1.Tag.%s.Value' % i])
+        i += 1
+    return(tags)
+
+
+class SimulatedEC2Connection(object):
+    """ Stand-in for boto.ec2.connection.EC2Connection, working on the
+        in-memory state of a SimulatedEC2 object
+
+        Every call waits for the configured latency, may be throttled, and
+        goes through throttle.throttled_call as the calls to EC2 do.
+
+    Properties:
+        region: A SimulatedRegion object
+        ec2: The SimulatedEC2 object for the region
+    """
+
+    def __init__(self, ec2):
+        self.ec2 = ec2
+        self.region = SimulatedRegion(ec2.region)
+        self.APIVersion = DEFAULT_API_VERSION
+
+    def _check_version(self, action, params):
+        # Unknown actions and parameters for the API version are rejected as
+        # EC2 does
+        if self.APIVersion < ACTION_API_VERSIONS.get(action, ''):
+            raise ec2_error(400, 'InvalidAction',
+                            'The action %s is not valid for this web service.'
+                            % action)
+        for param in params:
+            name = param.split('.')[0]
+            if self.APIVersion < PARAMETER_API_VERSIONS.get(name, ''):
+                raise ec2_error(400, 'UnknownParameter',
+                                'The parameter %s is not recognized' % name)
+
+    def _call(self, action, function, *args):
+        return(throttled_call(self.region.name, action, self._invoke, action,
+                              function, *args))
+
+    def _invoke(self, action, function, *args):
+        config = self.ec2.config
+        sleep(config['latencies'].get(action, config['latency']))
+        with self.ec2.lock:
+            if self.ec2.random.random() < config['throttle_rate']:
+                raise ec2_error(503, 'RequestLimitExceeded',
+                                'Request limit exceeded.')
+            return(function(*args))
+
+    def _dry_run(self, dry_run):
+        if dry_run:
+            raise ec2_error(412, 'DryRunOperation',
+                            'Request would have succeeded, but DryRun flag '
+                            'is set.')
+
+    # Filters
+
+    def build_filter_params(self, params, filters):
+        i = 1
+        for name, values in filters.iteritems():
+            params['Filter.%s.Name' % i] = name
+            for j, value in enumerate(as_list(values), 1):
+                params['Filter.%s.Value.%s' % (i, j)] = value
+            i += 1
+
+    # Generic calls
+
+    def get_list(self, action, params, markers, path='/', parent=None,
+                 verb='GET'):
+        self._check_version(action, params)
+        if action == 'DescribeSnapshots':
+            return(self._call(action, self._describe_snapshots_page,
+                              dict(params)))
+        elif action == 'DescribeVolumesModifications':
+            return(self._call(action, self._describe_modifications,
+                              parse_filter_params(params)))
+        raise ec2_error(400, 'InvalidAction', 'Unknown action %s' % action)
+
+    def get_object(self, action, params, cls, path='/', parent=None,
+                   verb='GET'):
+        self._check_version(action, params)
+        if action == 'CreateSnapshot':
+            return(self._call(action, self._create_snapshot, dict(params)))
+        elif action == 'ModifyVolume':
+            return(self._call(action, self._modify_volume, dict(params)))
+        raise ec2_error(400, 'InvalidAction', 'Unknown action %s' % action)
+
+    # Instances
+
+    def get_only_instances(self, instance_ids=None, filters=None,
+                           dry_run=False):
+        return(self._call('DescribeInstances', self._describe_instances,
+                          as_list(instance_ids), filters or {}))
+
+    def _describe_instances(self, instance_ids, filters):
+        ec2 = self.ec2
+        if instance_ids is not None:
+            instances = [ec2.get(ec2.instances, instance_id,
+                                 'InvalidInstanceID.NotFound')
+                         for instance_id in instance_ids]
+        else:
+            instances = ec2.instances.values()
+        ids = _filter_values(filters, 'instance-id')
+        names = _filter_values(filters, 'tag:Name')
+        states = _filter_values(filters, 'instance-state-name')
+        result = []
+        for instance in instances:
+            instance.update_state(time())
+            if ((ids is None or instance.id in ids) and
+                    (names is None or instance.tags.get('Name') in names) and
+                    (states is None or instance.state in states)):
+                result.append(instance.copy())
+        return(result)
+
+    def stop_instances(self, instance_ids=None, force=False, dry_run=False):
+        return(self._call('StopInstances', self._change_instances,
+                          as_list(instance_ids), 'running', 'stopping',
+                          'stopped', dry_run))
+
+    def start_instances(self, instance_ids=None, dry_run=False):
+        return(self._call('StartInstances', self._change_instances,
+                          as_list(instance_ids), 'stopped', 'pending',
+                          'running', dry_run))
+
+    def _change_instances(self, instance_ids, source, transition, target,
+                          dry_run):
+        ec2 = self.ec2
+        instances = [ec2.get(ec2.instances, instance_id,
+                             'InvalidInstanceID.NotFound')
+                     for instance_id in instance_ids]
+        for instance in instances:
+            if instance.state not in (source, transition, target):
+                raise ec2_error(400, 'IncorrectInstanceState',
+                                "The instance '%s' is not in a state from "
+                                "which it can be changed" % instance.id)
+        self._dry_run(dry_run)
+        for instance in instances:
+            if instance.state == source:
+                instance.state = transition
+                instance.schedule(ec2.later(), state=target)
+        return([instance.copy() for instance in instances])
+
+    # Volumes
+
+    def get_all_volumes(self, volume_ids=None, filters=None, dry_run=False):
+        return(self._call('DescribeVolumes', self._describe_volumes,
+                          as_list(volume_ids), filters or {}))
+
+    def _describe_volumes(self, volume_ids, filters):
+        ec2 = self.ec2
+        if volume_ids is not None:
+            volumes = [ec2.get(ec2.volumes, volume_id,
+                               'InvalidVolume.NotFound')
+                       for volume_id in volume_ids]
+        else:
+            volumes = ec2.volumes.values()
+        ids = _filter_values(filters, 'volume-id')
+        instances = _filter_values(filters, 'attachment.instance-id')
+        result = []
+        for volume in volumes:
+            volume.update_state(time())
+            volume.attach_data.update_state(time())
+            if ((ids is None or volume.id in ids) and
+                    (instances is None or
+                     volume.attach_data.instance_id in instances)):
+                result.append(volume.copy())
+        return(result)
+
+    def create_volume(self, size, zone, snapshot=None, volume_type=None,
+                      iops=None, encrypted=False, kms_key_id=None,
+                      dry_run=False):
+        return(self._call('CreateVolume', self._create_volume, size, zone,
+                          snapshot, volume_type, iops, encrypted, dry_run))
+
+    def _create_volume(self, size, zone, snapshot_id, volume_type, iops,
+                       encrypted, dry_run):
+        ec2 = self.ec2
+        if snapshot_id is not None:
+            snapshot = ec2.get(ec2.snapshots, snapshot_id,
+                               'InvalidSnapshot.NotFound')
+            if snapshot.status != 'completed':
+                raise ec2_error(400, 'IncorrectState', "Snapshot '%s' is not "
+                                "completed" % snapshot_id)
+            encrypted = snapshot.encrypted
+        self._dry_run(dry_run)
+        volume = SimulatedVolume(ec2.new_id('vol'), ec2.region, size,
+                                 volume_type or 'standard', iops, zone,
+                                 encrypted, snapshot_id, 'creating')
+        volume.schedule(ec2.later(), status='available')
+        ec2.volumes[volume.id] = volume
+        return(volume.copy())
+
+    def attach_volume(self, volume_id, instance_id, device, dry_run=False):
+        return(self._call('AttachVolume', self._attach_volume, volume_id,
+                          instance_id, device, dry_run))
+
+    def _attach_volume(self, volume_id, instance_id, device, dry_run):
+        ec2 = self.ec2
+        volume = ec2.get(ec2.volumes, volume_id, 'InvalidVolume.NotFound')
+        ec2.get(ec2.instances, instance_id, 'InvalidInstanceID.NotFound')
+        if volume.status != 'available':
+            raise ec2_error(400, 'IncorrectState', "Volume '%s' is not "
+                            "available" % volume_id)
+        self._dry_run(dry_run)
+        volume.status = 'in-use'
+        volume.attach_data = SimulatedAttachment(instance_id, device,
+                                                 'attaching')
+        volume.attach_data.schedule(ec2.later(), status='attached')
+        return('attaching')
+
+    def detach_volume(self, volume_id, instance_id=None, device=None,
+                      force=False, dry_run=False):
+        return(self._call('DetachVolume', self._detach_volume, volume_id,
+                          dry_run))
+
+    def _detach_volume(self, volume_id, dry_run):
+        ec2 = self.ec2
+        volume = ec2.get(ec2.volumes, volume_id, 'InvalidVolume.NotFound')
+        volume.attach_data.update_state(time())
+        if volume.attach_data.status != 'attached':
+            raise ec2_error(400, 'IncorrectState', "Volume '%s' is not "
+                            "attached" % volume_id)
+        self._dry_run(dry_run)
+        volume.attach_data.status = 'detaching'
+
+        def detached(volume):
+            volume.attach_data = SimulatedAttachment()
+        volume.schedule(ec2.later(), status='available',
+                        attach_data=detached)
+        return('detaching')
+
+    def delete_volume(self, volume_id, dry_run=False):
+        return(self._call('DeleteVolume', self._delete_volume, volume_id,
+                          dry_run))
+
+    def _delete_volume(self, volume_id, dry_run):
+        ec2 = self.ec2
+        volume = ec2.get(ec2.volumes, volume_id, 'InvalidVolume.NotFound')
+        if volume.status != 'available':
+            raise ec2_error(400, 'VolumeInUse', "Volume '%s' is in use"
+                            % volume_id)
+        self._dry_run(dry_run)
+        del ec2.volumes[volume_id]
+        return(True)
+
+    def _modify_volume(self, params):
+        ec2 = self.ec2
+        volume = ec2.get(ec2.volumes, params['VolumeId'],
+                         'InvalidVolume.NotFound')
+        modification = ec2.modifications.get(volume.id)
+        if modification is not None:
+            modification.update_state(time())
+            if modification.state != 'completed':
+                raise ec2_error(400, 'IncorrectModificationState',
+                                "Volume '%s' is already being modified"
+                                % volume.id)
+        if volume.type == 'standard':
+            raise ec2_error(400, 'UnsupportedOperation', "Volume '%s' can "
+                            "not be modified" % volume.id)
+        self._dry_run(params.get('DryRun') == 'true')
+        modification = SimulatedModification(volume.id, params['VolumeType'],
+                                             params.get('Iops'))
+
+        def optimizing(modification):
+            modification.state = 'optimizing'
+            modification.progress = 50
+            volume.type = modification.target_type
+            volume.iops = modification.target_iops
+        modification.schedule(ec2.later(), state=optimizing)
+        modification.schedule(ec2.later(2 * ec2.config['transition_seconds']),
+                              state='completed', progress=100)
+        ec2.modifications[volume.id] = modification
+        return(modification.copy())
+
+    def _describe_modifications(self, filters):
+        ec2 = self.ec2
+        ids = _filter_values(filters, 'volume-id')
+        result = SimulatedResultSet()
+        for volume_id, modification in ec2.modifications.iteritems():
+            if ids is None or volume_id in ids:
+                modification.update_state(time())
+                result.append(modification.copy())
+        return(result)
+
+    # Snapshots
+
+    def get_all_snapshots(self, snapshot_ids=None, owner=None,
+                          restorable_by=None, filters=None, dry_run=False):
+        params = {}
+        if snapshot_ids is not None:
+            params['SnapshotIds'] = as_list(snapshot_ids)
+        self.build_filter_params(params, filters or {})
+        return(self._call('DescribeSnapshots', self._describe_snapshots,
+                          params))
+
+    def _describe_snapshots(self, params):
+        return([snapshot.copy() for snapshot in self._find_snapshots(params)])
+
+    def _find_snapshots(self, params):
+        # The snapshots themselves, not copies, matching a Describe call
+        ec2 = self.ec2
+        filters = parse_filter_params(params)
+        ids = _filter_values(filters, 'snapshot-id')
+        volume_ids = _filter_values(filters, 'volume-id')
+        if 'SnapshotIds' in params:
+            candidates = [ec2.get(ec2.snapshots, snapshot_id,
+                                  'InvalidSnapshot.NotFound').id
+                          for snapshot_id in params['SnapshotIds']]
+        elif ids is not None:
+            candidates = sorted(ids)
+        elif volume_ids is not None:
+            candidates = []
+            for volume_id in sorted(volume_ids):
+                candidates += ec2.snapshots_by_volume.get(volume_id, [])
+        else:
+            candidates = sorted(ec2.snapshots)
+        result = []
+        for snapshot_id in candidates:
+            snapshot = ec2.snapshots.get(snapshot_id)
+            if snapshot is None:
+                continue
+            snapshot.update_state(time())
+            if ((ids is None or snapshot.id in ids) and
+                    (volume_ids is None or snapshot.volume_id in volume_ids)):
+                result.append(snapshot)
+        return(result)
+
+    def _describe_snapshots_page(self, params):
+        snapshots = self._find_snapshots(params)
+        start = int(params.get('NextToken', 0))
+        size = min(int(params.get('MaxResults', len(snapshots) or 1)),
+                   self.ec2.config['max_results'])
+        result = SimulatedResultSet([snapshot.copy() for snapshot in
+                                     snapshots[start:start + size]])
+        if start + size < len(snapshots):
+            result.next_token = str(start + size)
+        return(result)
+
+    def _create_snapshot(self, params):
+        ec2 = self.ec2
+        volume = ec2.get(ec2.volumes, params['VolumeId'],
+                         'InvalidVolume.NotFound')
+        self._dry_run(params.get('DryRun') == 'true')
+        config = ec2.config
+        snapshot = SimulatedSnapshot(ec2.new_id('snap'), volume.id,
+                                     volume.size,
+                                     epoch_to_strf(int(time())), 'pending',
+                                     params.get('Description', ''),
+                                     volume.encrypted,
+                                     parse_tag_specification(params))
+        status = 'completed'
+        if ec2.random.random() < config['snapshot_failure_rate']:
+            status = 'error'
+        snapshot.schedule(ec2.later(volume.size /
+                                    float(config['snapshot_gb_per_second'])),
+                          status=status, progress='100%')
+        ec2.add_snapshot(snapshot)
+        return(snapshot.copy())
+
+    def delete_snapshot(self, snapshot_id, dry_run=False):
+        return(self._call('DeleteSnapshot', self._delete_snapshot,
+                          snapshot_id, dry_run))
+
+    def _delete_snapshot(self, snapshot_id, dry_run):
+        ec2 = self.ec2
+        snapshot = ec2.get(ec2.snapshots, snapshot_id,
+                           'InvalidSnapshot.NotFound')
+        self._dry_run(dry_run)
+        del ec2.snapshots[snapshot_id]
+        ec2.snapshots_by_volume[snapshot.volume_id].remove(snapshot_id)
+        return(True)
+
+    # Tags
+
+    def create_tags(self, resource_ids, tags, dry_run=False):
+        return(self._call('CreateTags', self._create_tags,
+                          as_list(resource_ids), tags, dry_run))
+
+    def _create_tags(self, resource_ids, tags, dry_run):
+        ec2 = self.ec2
+        resources = []
+        for resource_id in resource_ids:
+            for collection in (ec2.instances, ec2.volumes, ec2.snapshots):
+                if resource_id in collection:
+                    resources.append(collection[resource_id])
+                    break
+            else:
+                raise ec2_error(400, 'InvalidID', "The ID '%s' is not valid"
+                                % resource_id)
+        self._dry_run(dry_run)
+        for resource in resources:
+            resource.tags.update(tags)
+        return(True)
+
+
+def load_simulator(config):
+    """ Create the connection factory for a simulator
+
+    Args:
+        config: A dict with the simulator settings (see DEFAULT_CONFIG), or
+                a string with the path of a JSON file with them
+    Returns:
+        A function receiving a region name and returning a
+        SimulatedEC2Connection, for connection.set_connection_factory
+    """
+    if isinstance(config, basestring):
+        with open(config) as configfile:
+            config = json.load(configfile)
+    settings = dict(DEFAULT_CONFIG)
+    settings.update(config)
+
+    def factory(region):
+        with _simulators_lock:
+            ec2 = _simulators.get((id(settings), region))
+            if ec2 is None:
+                ec2 = _simulators[(id(settings), region)] = SimulatedEC2(
+                    region, settings)
+        return(SimulatedEC2Connection(ec2))
+    return(factory)
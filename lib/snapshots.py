@@ -18,17 +18,31 @@
 # along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from connection import ec2conn
-from datetime import datetime, timedelta
-from dateutils import timedelta_months, timedelta_to_strf
+from boto.ec2.snapshot import Snapshot
+from cache import cache_invalidate, cache_store, memoize
+from calendar import timegm
+from connection import MODERN_API_VERSION, api_version, ec2conn
+from datetime import datetime
+from dateutils import strf_to_epoch
 from exceptions import InstanceFetchError, InvalidVolume, InvalidSnapshot
+from exceptions import CreateTagsError
 from exceptions import NoSnapshotsForVolume, SnapshotCreateError
-from exceptions import SnapshotCreateTagError, SnapshotsFetchError
+from exceptions import SnapshotCreateTagError
+from exceptions import SnapshotDeleteError
+from exceptions import SnapshotsFetchError
 from exceptions import VolumeFetchError
 from instances import get_instance_by_id
-from time import sleep
+from retention import SnapshotRecord, classify_snapshots
+from tags import flush_tags, queue_tags
+from throttle import TokenBucket
+from waiter import wait_for
+from workers import DEFAULT_MAX_WORKERS, WorkerPool
 
+# Maximum number of snapshots to fetch per DescribeSnapshots call
+SNAPSHOTS_PAGE_SIZE = 1000
 
+
+@memoize('snapshot')
 def get_snapshot_by_id(snapshot_id, region):
     """ Get a snapshot for a given snapshot id
 
@@ -47,40 +61,104 @@ def get_snapshot_by_id(snapshot_id, region):
     return(snapshot)
 
 
+def iter_snapshots(region, filters=None):
+    """ Iterate over the snapshots owned by the account, fetching them page
+        by page
+
+    Args:
+        region: A string with the AWS region where the snapshots are
+        filters: A dict with the filters for the API call (optional)
+    Returns:
+        A generator of boto.ec2.snapshot.Snapshot objects
+    Raises:
+        SnapshotsFetchError: If there was a problem fetching the snapshots
+    """
+    conn = ec2conn(region)
+    params = {'Owner.1': 'self', 'MaxResults': SNAPSHOTS_PAGE_SIZE}
+    if filters is not None:
+        conn.build_filter_params(params, filters)
+    while True:
+        # The pagination parameters are missing from the default API version
+        # of boto. Only the call is in the block, as the connection may be
+        # used by the caller between pages
+        try:
+            with api_version(conn, MODERN_API_VERSION):
+                page = conn.get_list('DescribeSnapshots', params,
+                                     [('item', Snapshot)], verb='POST')
+        except Exception as e:
+            raise SnapshotsFetchError(e)
+        for snapshot in page:
+            yield snapshot
+        if not page.next_token:
+            break
+        params['NextToken'] = page.next_token
+
+
 def get_snapshots_by_volume_id(volume_id, region):
-    """ Get a list of snapshots for a given volume-id
+    """ Get the snapshots for a given volume-id
 
     Args:
         volume_id: A string with the volume-id for the snapshot
         region: A string with the AWS region where the snapshot is
     Returns:
-        A list of boto.ec2.snapshot.Snapshot objects belonging to the volume
+        A generator of boto.ec2.snapshot.Snapshot objects belonging to the
+        volume
     Raises:
         SnapshotsFetchError: If there was a problem fetching the snapshots
         NoSnapshotsForVolume: If the volume has not any snapshot
     """
-    snapshots = []
-    conn = ec2conn(region)
-    # Test if the volume exist
-    from volumes import get_volume_by_id
-    get_volume_by_id(volume_id, region)
     # Get all the snapshots for the given volume
-    snapshots = []
-    try:
-        all_snapshots = conn.get_all_snapshots(owner='self')
-    except Exception as e:
-        raise SnapshotsFetchError(e)
-    for snapshot in all_snapshots:
-        if snapshot.volume_id == volume_id:
-            snapshots.append(snapshot)
-    if len(snapshots) == 0:
+    found = False
+    for snapshot in iter_snapshots(region, {'volume-id': volume_id}):
+        found = True
+        yield snapshot
+    if not found:
+        # Test if the volume exist
+        from volumes import get_volume_by_id
+        get_volume_by_id(volume_id, region)
         raise NoSnapshotsForVolume(volume_id)
-    return(snapshots)
+
+
+def snapshot_record(snapshot):
+    """ Get the record for a snapshot, to compute its retention
+
+    Args:
+        snapshot: A boto.ec2.snapshot.Snapshot object
+    Returns:
+        A retention.SnapshotRecord object
+    """
+    return(SnapshotRecord(snapshot.id, strf_to_epoch(snapshot.start_time)))
+
+
+def get_snapshots_inventory(region, volume_ids=None):
+    """ Get the snapshots owned by the account, indexed by volume-id
+
+    Args:
+        region: A string with the AWS region where the snapshots are
+        volume_ids: A list of strings with the volume-ids to fetch snapshots
+                    for (optional, all the snapshots are fetched if None)
+    Returns:
+        A dict with volume-ids as keys and lists of
+        retention.SnapshotRecord objects as values
+    Raises:
+        SnapshotsFetchError: If there was a problem fetching the snapshots
+    """
+    filters = None
+    if volume_ids is not None:
+        filters = {'volume-id': list(volume_ids)}
+    inventory = {}
+    for snapshot in iter_snapshots(region, filters):
+        inventory.setdefault(snapshot.volume_id, []).append(
+            snapshot_record(snapshot))
+    return(inventory)
 
 
 def create_snapshot_tag(snapshot, region, tagname, value):
     """ Create a new tag for the given snapshot
 
+        The tag is written together with the other tags queued by this
+        thread for the region (see tags.flush_tags)
+
     Args:
         volume_id: A string with the snapshot-id for the snapshot
         region: A string with the AWS region where the snapshot is
@@ -91,17 +169,15 @@ def create_snapshot_tag(snapshot, region, tagname, value):
     Raises:
         SnapshotCreateTagError: If it was not possible to create the tag
     """
-    try:
-        conn = ec2conn(region)
-        conn.create_tags(snapshot.id, {"%s" % tagname: "%s" % value})
-    except Exception as e:
-        raise SnapshotCreateTagError(e)
-    return(True)
+    return(create_snapshot_tags(snapshot, region, {tagname: value}))
 
 
 def create_snapshot_tags(snapshot, region, tags):
     """ Create tags for the given snapshot
 
+        Tags are written together with the other tags queued by this thread
+        for the region (see tags.flush_tags)
+
     Args:
         volume_id: A string with the snapshot-id for the snapshot
         region: A string with the AWS region where the snapshot is
@@ -109,12 +185,12 @@ def create_snapshot_tags(snapshot, region, tags):
     Returns:
         True if the operation succeeded
     Raises:
-        SnapshotCreateTagError: If it was not possible to create the tag
+        SnapshotCreateTagError: If it was not possible to create the tags
     """
+    queue_tags(snapshot.id, region, tags)
     try:
-        conn = ec2conn(region)
-        conn.create_tags(snapshot.id, tags)
-    except Exception as e:
+        flush_tags(region)
+    except CreateTagsError as e:
         raise SnapshotCreateTagError(e)
     return(True)
 
@@ -161,9 +237,25 @@ def create_snapshot_by_volume_id(volume_id, region, dry, name=None,
             description = "%s %s" % (instance_name, device)
         else:
             description = 'Volume was not attached'
-    # Perform the snapshot
+    # Tags are created with the snapshot
+    tags = dict(Name=name)
+    if savetags:
+        for tagkey, tagvalue in volume.tags.iteritems():
+            if tagkey != 'Name' and tagkey.split(':')[0] != 'aws':
+                tags[tagkey] = tagvalue
+    params = {'VolumeId': volume_id, 'Description': description[0:255],
+              'TagSpecification.1.ResourceType': 'snapshot'}
+    for i, (tagkey, tagvalue) in enumerate(sorted(tags.iteritems()), 1):
+        params['TagSpecification.1.Tag.%s.Key' % i] = tagkey
+        params['TagSpecification.1.Tag.%s.Value' % i] = tagvalue
+    if dry:
+        params['DryRun'] = 'true'
+    # Perform the snapshot. TagSpecification is missing from the default API
+    # version of boto
     try:
-        snapshot = conn.create_snapshot(volume_id, description, dry_run=dry)
+        with api_version(conn, MODERN_API_VERSION):
+            snapshot = conn.get_object('CreateSnapshot', params, Snapshot,
+                                       verb='POST')
     except Exception as e:
         try:
             if 'DryRun flag is set' in e.body:
@@ -171,12 +263,6 @@ def create_snapshot_by_volume_id(volume_id, region, dry, name=None,
         except:
             raise SnapshotCreateError(e)
     if dry is False:
-        tags = dict(Name=name)
-        if savetags:
-            for tagkey, tagvalue in volume.tags.iteritems():
-                if tagkey != 'Name' and tagkey.split(':')[0] != 'aws':
-                    tags[tagkey] = tagvalue
-        create_snapshot_tags(snapshot, region, tags)
         return(snapshot)
     else:
         return(None)
@@ -191,58 +277,174 @@ def snapshot_wait_creation(snapshot_id, region):
     Raises:
         SnapshotCreateError: If there was an error creating the snapshot
     """
-    conn = ec2conn(region)
-    snapshot = conn.get_all_snapshots(snapshot_id)[0]
     try:
-        while snapshot.status != "completed":
-            sleep(60)
-            snapshot.update(validate=True)
+        # The new snapshot may not be described yet (eventual consistency),
+        # so it is still pending while it is missing
+        snapshot = wait_for('snapshot', snapshot_id, region,
+                            lambda s: s is not None and
+                            s.status != "pending")
     except Exception as e:
         raise SnapshotCreateError(e)
+    if snapshot.status != "completed":
+        raise SnapshotCreateError("Snapshot %s was not completed"
+                                  % snapshot_id)
+    cache_store('snapshot', region, snapshot)
 
 
-class SavedSnapshot(object):
-
-    """ Class to create snapshot objects for the save list
+def create_test_snapshot_objects(total):
+    """ Create an array with n*3 snapshot records for testing
 
         Args:
-            start_time: A datetime object with the start time of the snapshot
-            id: A string with the snapshot identifier
-            type: A string with the snapshot type
+            total: number of snapshot objects to create
+        Returns:
+            A list of retention.SnapshotRecord objects
     """
+    snapshots = []
+    now = timegm(datetime.utcnow().timetuple())
+    for i in range(0, total):
+        start = now - i * 86400
+        snapshots.append(SnapshotRecord("snap-%07da" % i, start))
+        snapshots.append(SnapshotRecord("snap-%07db" % i, start - 1800))
+        snapshots.append(SnapshotRecord("snap-%07dc" % i, start - 7200))
+    return(snapshots)
 
-    def __init__(self, id, start_time, type=None):
-        self.id = id
-        self.type = type
-        self.start_time = start_time
 
+def delete_snapshot_by_id(snapshot_id, region, dry):
+    """ Delete a snapshot
 
-def create_test_snapshot_objects(total):
-    """ Create an array with n*3 snapshot objects for testing
+    Args:
+        snapshot_id: A string with the snapshot-id
+        region: A string with the AWS region where the snapshot is
+        dry: A boolean stating if the action is simulated or not
+    Returns:
+        True if the snapshot was deleted
+    Raises:
+        SnapshotDeleteError: If there was an error deleting the snapshot
+    """
+    conn = ec2conn(region)
+    try:
+        conn.delete_snapshot(snapshot_id, dry_run=dry)
+    except Exception as e:
+        try:
+            if 'DryRun flag is set' in e.body:
+                return(True)
+        except:
+            pass
+        raise SnapshotDeleteError(snapshot_id, e)
+    cache_invalidate('snapshot', region, snapshot_id)
+    return(True)
+
+
+def delete_snapshot_record(snapshot, region, dry):
+    """ Delete a snapshot, saving the error (if any) at its record
+
+    Args:
+        snapshot: A retention.SnapshotRecord object
+        region: A string with the AWS region where the snapshot is
+        dry: A boolean stating if the action is simulated or not
+    """
+    try:
+        delete_snapshot_by_id(snapshot.id, region, dry)
+    except SnapshotDeleteError as e:
+        snapshot.error = e.error
+
+
+class SnapshotDeleter(object):
+    """ Pool to delete snapshots in parallel, for all the volumes in a run,
+        with a cap on the number of DeleteSnapshot requests per second
+
+    Properties:
+        region: A string with the AWS region where the snapshots are
+        dry: A boolean stating if the action is simulated or not
+        max_workers: An integer with the maximum number of parallel deletions
+        rate: A number with the maximum number of deletions per second for
+              the whole run (optional, only the DeleteSnapshot rate at
+              throttle.ACTION_RATES if None or 0). Deletions are still
+              subject to that rate, so it also caps higher values
+    """
+
+    def __init__(self, region, dry, max_workers=DEFAULT_MAX_WORKERS,
+                 rate=None):
+        self.region = region
+        self.dry = dry
+        self.pool = WorkerPool(max_workers)
+        # Shared by all the workers, so it is the budget for the whole run.
+        # A single token means no burst over the rate
+        if rate:
+            self.bucket = TokenBucket(rate, 1)
+        else:
+            self.bucket = None
+
+    def _delete(self, snapshot, callback):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        delete_snapshot_record(snapshot, self.region, self.dry)
+        if callback is not None:
+            callback(snapshot)
+
+    def delete(self, snapshot, callback=None):
+        """ Queue the deletion of a snapshot. The error (if any) is saved at
+            its record once the deletion is finished
 
         Args:
-            total: number of snapshot objects to create
+            snapshot: A retention.SnapshotRecord object
+            callback: A function to call with the record once the deletion
+                      is finished, from the worker thread (optional)
         Returns:
-            A list of SavedSnapshot objects
+            A workers.Future object for the deletion
+        """
+        return(self.pool.submit(snapshot.id, self._delete, snapshot,
+                                callback))
+
+    def shutdown(self):
+        """ Wait until all the queued deletions are finished """
+        self.pool.shutdown()
+
+
+def plan_snapshots_by_volume_id(volume_id, region, hourly_backups,
+                                daily_backups, weekly_backups,
+                                monthly_backups, test, test_number,
+                                inventory=None):
+    """ Compute the retention for the snapshots of an EBS ID, without
+        deleting any snapshot
+
+      Args:
+          volume_id: A string with the EBS volume-id
+          region: A string with the AWS region where the volume is
+          hourly_backups: An integer with the number of hourly backups to save
+          daily_backups: An integer with the number of daily backups to save
+          weekly_backups: An integer with the number of weekly backups to save
+          monthly_backups: An integer with the number of monthly backups to
+                           salve, or True to save all monthly backups, or False
+                           to delete all monthly backups.
+          test: run the function with testing snapshots (not real)
+          test_number: the number of testing snapshots
+          inventory: A dict with snapshots indexed by volume-id, as returned
+                     by get_snapshots_inventory (optional, if None the
+                     snapshots for the volume are fetched)
+      Returns:
+          A list of retention.SnapshotRecord objects, as returned by
+          retention.classify_snapshots
     """
-    snapshots = []
-    now = datetime.utcnow()
-    for i in range(0, total):
-        snapshots.append(SavedSnapshot("snap-%07da" % i,
-                                       timedelta_to_strf(now, days=i)))
-        snapshots.append(SavedSnapshot("snap-%07db" % i,
-                                       timedelta_to_strf(now, days=i,
-                                                         minutes=30)))
-        snapshots.append(SavedSnapshot("snap-%07dc" % i,
-                                       timedelta_to_strf(now, days=i,
-                                                         minutes=120)))
-    return(snapshots)
+    # Fill the list of snapshots
+    if test is True:
+        snapshots = create_test_snapshot_objects(test_number)
+    elif inventory is not None:
+        snapshots = inventory.get(volume_id, [])
+        if len(snapshots) == 0:
+            raise NoSnapshotsForVolume(volume_id)
+    else:
+        snapshots = [snapshot_record(snapshot) for snapshot in
+                     get_snapshots_by_volume_id(volume_id, region)]
+    return(classify_snapshots(snapshots, hourly_backups, daily_backups,
+                              weekly_backups, monthly_backups,
+                              datetime.utcnow()))
 
 
 def clean_snapshots_by_volume_id(volume_id, region, hourly_backups,
                                  daily_backups, weekly_backups,
                                  monthly_backups, dry, test,
-                                 test_number):
+                                 test_number, inventory=None, deleter=None):
     """ Clean EBS Snapshots for a given EBS ID
 
       Args:
@@ -257,171 +459,45 @@ def clean_snapshots_by_volume_id(volume_id, region, hourly_backups,
           dry: A boolean stating if the action is simulated or not
           test: run the function with testing snapshots (not real)
           test_number: the number of testing snapshots
+          inventory: A dict with snapshots indexed by volume-id, as returned
+                     by get_snapshots_inventory (optional, if None the
+                     snapshots for the volume are fetched)
+          deleter: A SnapshotDeleter object to queue the deletions at
+                   (optional, if None the snapshots are deleted before
+                   returning). When present, the errors are only available
+                   after deleter.shutdown()
       Returns:
-          A list with dicts in the form
-          {
-            'snapshot-id': '...',
-            'start_time' : '...',
-            'type' : '...',
-            'error': '...'
-          }
+          A list of retention.SnapshotRecord objects
 
           If type is not None, the snapshot was saved, else was deleted
           If error is not None, the procedure tried to deleted the snapshot
           but it couldn't because of an error, and the field contains the
           error's value
     """
-    now = datetime.utcnow()
-    # Datetimes for most recent limits for each kind of backup
-    last_hour = datetime(now.year, now.month, now.day, now.hour)
-    last_midnight = datetime(now.year, now.month, now.day)
-    last_sunday = (datetime(now.year, now.month, now.day) -
-                   timedelta(days=(now.weekday() + 1) % 7))
-    last_first = datetime(now.year, now.month, 1)
-
-    # There are no snapshots older than 1/1/2006 (year when AWS started
-    # working
-    oldest_snapshot_date = datetime(2006, 1, 1)
-
-    # Fill the list of snapshots
-    if test is True:
-        snapshots = create_test_snapshot_objects(test_number)
-    else:
-        snapshots = get_snapshots_by_volume_id(volume_id, region)
-
-    # Sort snapshots by date and time (descending)
-    snapshots.sort(cmp=lambda x,
-                   y: cmp(x.start_time, y.start_time), reverse=True)
+    snapshots = plan_snapshots_by_volume_id(volume_id, region, hourly_backups,
+                                            daily_backups, weekly_backups,
+                                            monthly_backups, test,
+                                            test_number, inventory)
+    if test is False:
+        delete_unsaved_snapshots(snapshots, region, dry, deleter)
+    return(snapshots)
 
-    # No days, weeks or monts founds so far
-    find_hours = 0
-    find_days = 0
-    find_weeks = 0
-    find_months = 0
 
-    # Dictionary to save snapshots to be preserved
-    processed_snapshots = []
+def delete_unsaved_snapshots(snapshots, region, dry, deleter=None):
+    """ Delete the snapshots not to be saved from a list of snapshot records
 
+      Args:
+          snapshots: A list of retention.SnapshotRecord objects, as returned
+                     by retention.classify_snapshots
+          region: A string with the AWS region where the snapshots are
+          dry: A boolean stating if the action is simulated or not
+          deleter: A SnapshotDeleter object to queue the deletions at
+                   (optional, if None the snapshots are deleted before
+                   returning)
+    """
     for snapshot in snapshots:
-        processed_snapshots.append({"snapshot_id": snapshot.id,
-                                    "start_time": snapshot.start_time,
-                                    "type": None,
-                                    "error": None})
-        # Convert snapshot date (string) to date object to compare
-        snapshot_date = datetime.strptime(snapshot.start_time,
-                                          '%Y-%m-%dT%H:%M:%S.000Z')
-        found = False
-
-        # Test every hour till oldest_snapshot_date and save if we still
-        # don't have enough hourly backups
-        if find_hours < hourly_backups:
-            hours = 0
-            while (not found and ((last_hour - timedelta(hours=hours)) >
-                                  oldest_snapshot_date)):
-                if ((snapshot_date.date() == (last_hour -
-                   timedelta(hours=hours)).date()) and
-                    (snapshot_date.hour == (last_hour -
-                                            timedelta(hours=hours)).hour)):
-                    for i in range(len(processed_snapshots)):
-                        if (processed_snapshots[i]['snapshot_id'] ==
-                                snapshot.id):
-                            processed_snapshots[i]['type'] = "hourly"
-                    find_hours += 1
-                    found = True
-                    # To ignore more backups for the day, jump to the previous
-                    # hour
-                    last_hour = last_hour - timedelta(hours=hours + 1)
-                hours += 1
-
-        # Test every day till oldest_snapshot_date and save if we still
-        # don't have enough daily backups
-        elif find_days < daily_backups:
-            days = 0
-            while (not found and ((last_midnight - timedelta(days=days)) >
-                                  oldest_snapshot_date)):
-                if snapshot_date.date() == (last_midnight -
-                                            timedelta(days=days)).date():
-                    for i in range(len(processed_snapshots)):
-                        if (processed_snapshots[i]['snapshot_id'] ==
-                                snapshot.id):
-                            processed_snapshots[i]['type'] = "daily"
-                    find_days += 1
-                    last_sunday = (snapshot_date -
-                                   timedelta(days=(snapshot_date.weekday() + 1)
-                                             % 7))
-                    # If the snapshot is sunday, then the calculate previous
-                    # sunday
-                    if last_sunday.date() == snapshot_date.date():
-                        last_sunday = (snapshot_date -
-                                       timedelta(days=(snapshot_date.weekday()
-                                                       + 1)
-                                                 % 7 + 7))
-                    found = True
-                    # To ignore more backups for the day, jump to the previous
-                    # midnight
-                    last_midnight = last_midnight - timedelta(days=days + 1)
-                days += 1
-
-        # Test every sunday till oldest_snapshot_date and save if we still
-        # don't have enough weekly backups
-        elif find_weeks < weekly_backups:
-            weeks = 0
-            while (not found and ((last_sunday - timedelta(days=weeks * 7)) >
-                                  oldest_snapshot_date)):
-                # If snapshot date is equal to the tested sunday, save it
-                if (snapshot_date.date() == (last_sunday -
-                   timedelta(days=weeks * 7)).date()):
-                    for i in range(len(processed_snapshots)):
-                        if (processed_snapshots[i]['snapshot_id'] ==
-                                snapshot.id):
-                            processed_snapshots[i]['type'] = "weekly"
-                    find_weeks += 1
-                    last_first = timedelta_months(snapshot_date, 0)
-                    # If the snapshot the first of the month, then the
-                    # calculate previous one
-                    if last_first.date() == snapshot_date.date():
-                        last_first = timedelta_months(last_first, 1)
-                    found = True
-                    # To ignore more backups for the week, jump to the previous
-                    # sunday
-                    last_sunday = (
-                        last_sunday - timedelta(days=(weeks + 1) * 7))
-                weeks += 1
-
-        # Test 1st day of every month till oldest_snapshot_date and save if we
-        # still don't have enough hourly backups
-        elif (find_months < monthly_backups) or monthly_backups is True:
-            months = 0
-            while (not found and
-                   (timedelta_months(last_first, months) >
-                    oldest_snapshot_date)):
-                if (snapshot_date.date() ==
-                        timedelta_months(last_first, months).date()):
-                    for i in range(len(processed_snapshots)):
-                        if (processed_snapshots[i]['snapshot_id'] ==
-                           snapshot.id):
-                            processed_snapshots[i]['type'] = "monthly"
-                    find_months += 1
-                    found = True
-                    # To ignore more backups for the month, jump to the
-                    # previous month start
-                    last_first = timedelta_months(last_first, months + 1)
-                months += 1
-    for snapshot in snapshots:
-        for i in range(len(processed_snapshots)):
-            if (processed_snapshots[i]['snapshot_id'] == snapshot.id and
-                    processed_snapshots[i]['type'] is None):
-                if test is False:
-                    try:
-                        snapshot.delete(dry_run=dry)
-                    except Exception as e:
-                        try:
-                            if 'DryRun flag is set' in e:
-                                pass
-                        except:
-                            for i in range(len(processed_snapshots)):
-                                if (processed_snapshots[i]['snapshot_id'] ==
-                                        snapshot.id):
-                                    processed_snapshots[i]['error'] = e
-                            pass
-    return(processed_snapshots)
+        if snapshot.type is None:
+            if deleter is not None:
+                deleter.delete(snapshot)
+            else:
+                delete_snapshot_record(snapshot, region, dry)
@@ -0,0 +1,194 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+import json
+
+
+class Span(object):
+    """ A timed phase of a task
+
+    Properties:
+        name: A string with the phase name (for example, detach)
+        volume_id: A string with the volume-id, or None for the phases of
+                   the whole run (for example, stopping the instance)
+        size: An integer with the volume size (GB)
+        vtype: A string with the volume type
+        start: A float with the start time (epoch seconds)
+        end: A float with the end time (epoch seconds)
+        error: A string with the error that finished the phase, if any
+    """
+
+    def __init__(self, name, volume_id=None, size=None, vtype=None):
+        self.name = name
+        self.volume_id = volume_id
+        self.size = size
+        self.vtype = vtype
+        self.start = time()
+        self.end = None
+        self.error = None
+
+    @property
+    def seconds(self):
+        return(self.end - self.start)
+
+    def to_dict(self):
+        return({'name': self.name,
+                'volume_id': self.volume_id,
+                'size': self.size,
+                'type': self.vtype,
+                'start': round(self.start, 3),
+                'end': round(self.end, 3),
+                'seconds': round(self.seconds, 3),
+                'error': self.error})
+
+
+class SpanRecorder(object):
+    """ Timed phases of the tasks of a run, recorded from any thread """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, volume=None):
+        """ Record the execution of a with block as a phase
+
+        Args:
+            name: A string with the phase name
+            volume: A boto.ec2.volume.Volume with the volume for the phase
+                    (optional)
+        """
+        if volume is not None:
+            span = Span(name, volume.id, volume.size, volume.type)
+        else:
+            span = Span(name)
+        try:
+            yield span
+        except Exception as e:
+            span.error = str(e)
+            raise
+        finally:
+            span.end = time()
+            with self.lock:
+                self.spans.append(span)
+
+    def phases(self):
+        """ Aggregate the spans by phase
+
+        Returns:
+            A dict with phase names as keys and dicts with the count, total,
+            mean and maximum seconds and the mean seconds per GB as values
+        """
+        with self.lock:
+            spans = list(self.spans)
+        phases = {}
+        for span in spans:
+            phase = phases.setdefault(span.name, {'count': 0, 'seconds': 0.0,
+                                                  'max_seconds': 0.0,
+                                                  'gb': 0})
+            phase['count'] += 1
+            phase['seconds'] += span.seconds
+            phase['max_seconds'] = max(phase['max_seconds'], span.seconds)
+            phase['gb'] += span.size or 0
+        for phase in phases.itervalues():
+            phase['mean_seconds'] = round(phase['seconds'] / phase['count'],
+                                          3)
+            if phase['gb'] > 0:
+                phase['seconds_per_gb'] = round(phase['seconds'] /
+                                                phase['gb'], 4)
+            else:
+                phase['seconds_per_gb'] = None
+            phase['seconds'] = round(phase['seconds'], 3)
+            phase['max_seconds'] = round(phase['max_seconds'], 3)
+        return(phases)
+
+    def elapsed(self, first, last):
+        """ Get the time between the start of a phase and the end of other
+
+        Args:
+            first: A string with the name of the first phase
+            last: A string with the name of the last phase
+        Returns:
+            A float with the seconds, or None if any of the phases is missing
+        """
+        with self.lock:
+            starts = [span.start for span in self.spans if span.name == first]
+            ends = [span.end for span in self.spans if span.name == last]
+        if not starts or not ends:
+            return(None)
+        return(max(ends) - min(starts))
+
+    def critical_path(self):
+        """ Get the chain of phases that determined the length of the run:
+            the phases of the whole run, and the phases of the volume that
+            finished last
+
+        Returns:
+            A dict with the volume-id of the last volume, the total seconds
+            and a list with the phases (name, seconds and share of the
+            total) in order
+        """
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        if not spans:
+            return({'volume_id': None, 'seconds': 0.0, 'phases': []})
+        last = {}
+        for span in spans:
+            if span.volume_id is not None:
+                last[span.volume_id] = max(last.get(span.volume_id, 0),
+                                           span.end)
+        volume_id = None
+        if last:
+            volume_id = max(last, key=lambda volume_id: last[volume_id])
+        path = [span for span in spans
+                if span.volume_id is None or span.volume_id == volume_id]
+        total = max([span.end for span in path]) - path[0].start
+        return({'volume_id': volume_id,
+                'seconds': round(total, 3),
+                'phases': [{'name': span.name,
+                            'volume_id': span.volume_id,
+                            'seconds': round(span.seconds, 3),
+                            'share': round(span.seconds / total, 3)
+                            if total > 0 else 0.0}
+                           for span in path]})
+
+    def summary(self):
+        """ Get all the spans, the aggregation by phase and the critical path
+
+        Returns:
+            A dict with the keys spans, phases and critical_path
+        """
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return({'spans': [span.to_dict() for span in spans],
+                'phases': self.phases(),
+                'critical_path': self.critical_path()})
+
+    def write(self, path):
+        """ Write the summary as JSON
+
+        Args:
+            path: A string with the path of the file
+        """
+        with open(path, 'w') as outfile:
+            json.dump(self.summary(), outfile, indent=2, sort_keys=True)
@@ -0,0 +1,166 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from connection import ec2conn
+from exceptions import CreateTagsError
+from threading import Lock, local
+
+# Maximum number of resources for a CreateTags call
+MAX_TAG_RESOURCES = 500
+
+_writers = {}
+_writers_lock = Lock()
+
+
+def coalesce_tags(pending):
+    """ Group tag writes into the fewest CreateTags requests, either grouping
+        the resources with the same tags, or grouping the tags that are
+        written to the same resources
+
+    Args:
+        pending: A dict with resource ids as keys and dicts with tags as
+                 values
+    Returns:
+        A list of tuples (resource_ids, tags), one for each request
+    """
+    by_tags = {}
+    for resource_id, tags in pending.iteritems():
+        by_tags.setdefault(frozenset(tags.iteritems()),
+                           []).append(resource_id)
+    by_resources = {}
+    for resource_id, tags in pending.iteritems():
+        for tag in tags.iteritems():
+            by_resources.setdefault(tag, []).append(resource_id)
+    by_tag_resources = {}
+    for tag, resource_ids in by_resources.iteritems():
+        by_tag_resources.setdefault(frozenset(resource_ids), []).append(tag)
+    if len(by_tag_resources) < len(by_tags):
+        requests = [(sorted(resource_ids), dict(tags)) for resource_ids, tags
+                    in by_tag_resources.iteritems()]
+    else:
+        requests = [(sorted(resource_ids), dict(tags)) for tags, resource_ids
+                    in by_tags.iteritems()]
+    # Split the requests with too many resources
+    return([(resource_ids[i:i + MAX_TAG_RESOURCES], tags)
+            for resource_ids, tags in requests
+            for i in range(0, len(resource_ids), MAX_TAG_RESOURCES)])
+
+
+class TagWriter(object):
+    """ Queue of tag writes for EC2 resources in a region, written with the
+        fewest CreateTags requests when flushed
+
+        Each thread has its own queue, so a task only writes (and reports
+        errors for) the tags it queued itself
+
+    Properties:
+        region: A string with the AWS region where the resources are
+    """
+
+    def __init__(self, region):
+        self.region = region
+        self.local = local()
+
+    def _pending(self):
+        """ Get the queued tags for the calling thread
+
+        Returns:
+            A dict with resource ids as keys and dicts with tags as values
+        """
+        pending = getattr(self.local, 'pending', None)
+        if pending is None:
+            pending = self.local.pending = {}
+        return(pending)
+
+    def add(self, resource_id, tags):
+        """ Queue tags for a resource, for the calling thread
+
+        Args:
+            resource_id: A string with the resource id
+            tags: A dict with names and values for the tags
+        """
+        resource_tags = self._pending().setdefault(resource_id, {})
+        for tagname, value in tags.iteritems():
+            resource_tags["%s" % tagname] = "%s" % value
+
+    def flush(self):
+        """ Write all the tags queued by the calling thread
+
+        Returns:
+            An integer with the number of CreateTags requests
+        Raises:
+            CreateTagsError: If it was not possible to create the tags (for
+                             the first failed request)
+        """
+        pending = self._pending()
+        self.local.pending = {}
+        requests = coalesce_tags(pending)
+        conn = ec2conn(self.region)
+        error = None
+        for resource_ids, tags in requests:
+            # A failed request does not stop writing the rest of the tags
+            try:
+                conn.create_tags(resource_ids, tags)
+            except Exception as e:
+                if error is None:
+                    error = CreateTagsError(resource_ids, e)
+        if error is not None:
+            raise error
+        return(len(requests))
+
+
+def get_tag_writer(region):
+    """ Get the tag writer for a region
+
+    Args:
+        region: A string with the AWS region
+    Returns:
+        A TagWriter object
+    """
+    with _writers_lock:
+        writer = _writers.get(region)
+        if writer is None:
+            writer = _writers[region] = TagWriter(region)
+    return(writer)
+
+
+def queue_tags(resource_id, region, tags):
+    """ Queue tags for a resource, to be written with flush_tags from the
+        same thread
+
+    Args:
+        resource_id: A string with the resource id
+        region: A string with the AWS region where the resource is
+        tags: A dict with names and values for the tags
+    """
+    get_tag_writer(region).add(resource_id, tags)
+
+
+def flush_tags(region):
+    """ Write all the tags queued by the calling thread for a region
+
+    Args:
+        region: A string with the AWS region
+    Returns:
+        An integer with the number of CreateTags requests
+    Raises:
+        CreateTagsError: If it was not possible to create the tags
+    """
+    return(get_tag_writer(region).flush())
@@ -18,29 +18,46 @@
 # along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from exceptions import CreateTagsError
 from exceptions import ErrorAllVolumesSameType, ErrorAllVolumesSamePIOPS
-from exceptions import InvalidVolumeType
+from exceptions import InvalidVolumeType, ParallelTasksFailed
+from exceptions import SnapshotDeleteError
+from exceptions import VolumeModificationUnavailable
+from functools import partial
 from instances import get_instance_by_id, get_instance_by_name
 from instances import start_instance_and_wait, stop_instance_and_wait
 from messages import print_error, print_info, print_ok, print_special
 from messages import print_warning
-from snapshots import clean_snapshots_by_volume_id
+from plan import RetentionPlan, read_plan
+from results import open_results
+from snapshots import SnapshotDeleter, delete_unsaved_snapshots
+from snapshots import get_snapshots_inventory, plan_snapshots_by_volume_id
 from snapshots import create_snapshot_by_volume_id, snapshot_wait_creation
-from threading import currentThread, enumerate, Thread
+from snapshots import delete_snapshot_by_id
+from spans import SpanRecorder
+from tags import flush_tags
+from time import time
 from volumes import attach_volume, check_iops_ratio, create_volume
-from volumes import delete_volume, detach_volume
+from volumes import delete_volume, detach_volume, modify_volume
 from volumes import get_volumes_from_instance_by_device
 from volumes import get_volumes_from_instance_by_name
+from volumes import volume_modification_wait
+from workers import DEFAULT_MAX_WORKERS, WorkerPool, failed_futures
 
 
 def task_clean_snapshots_ec2(region, instance_id=None, instance_name=None,
                              devices=None, volume_name=None,
                              hourly_backups=0, daily_backups=7,
                              weekly_backups=0, monthly_backups=4, dry=True,
-                             test=False, test_number=100):
+                             test=False, test_number=100,
+                             max_workers=DEFAULT_MAX_WORKERS, max_rate=None,
+                             plan_file=None, results_file=None):
     """ Clean snapshots for volumes attached to an EC2 instance, by device or
         by tag name
 
+        The snapshots for all the volumes are deleted in parallel by a single
+        pool, so max_rate is the budget for the whole run
+
         Args:
             instance_id: A string with the EC2 instance-id
             instance_name: A string with the EC2 instance name
@@ -58,6 +75,15 @@ def task_clean_snapshots_ec2(region, instance_id=None, instance_name=None,
             dry: A boolean stating if the action is simulated or not
             test: run the function with testing snapshots (not real)
             test_number: the number of testing snapshots
+            max_workers: An integer with the maximum number of snapshots to
+                         delete in parallel
+            max_rate: An integer with the maximum number of snapshots to
+                      delete per second (optional, the default DeleteSnapshot
+                      rate limit if None or 0)
+            plan_file: A string with a path to write the retention plan to,
+                       instead of deleting the snapshots (optional)
+            results_file: A string with a path to stream the results to as
+                          JSON Lines, instead of printing them (optional)
     """
     volumes = []
     if instance_name is not None:
@@ -70,17 +96,24 @@ def task_clean_snapshots_ec2(region, instance_id=None, instance_name=None,
     if volume_name is not None:
         volumes = get_volumes_from_instance_by_name(instance.id, volume_name,
                                                     region)
-    for volume in volumes:
-        task_clean_snapshots_ebs_id(volume.id, region, hourly_backups,
-                                    daily_backups, weekly_backups,
-                                    monthly_backups, dry, test,
-                                    test_number)
+    # Fetch the snapshots for all the volumes at once
+    inventory = None
+    if test is False:
+        inventory = get_snapshots_inventory(region,
+                                            [volume.id for volume in volumes])
+    clean_volumes_snapshots([volume.id for volume in volumes], region,
+                            hourly_backups, daily_backups, weekly_backups,
+                            monthly_backups, dry, test, test_number, inventory,
+                            max_workers, max_rate, plan_file, results_file)
 
 
 def task_clean_snapshots_ebs_id(volume_id, region, hourly_backups=0,
                                 daily_backups=7, weekly_backups=0,
                                 monthly_backups=4, dry=True, test=False,
-                                test_number=100):
+                                test_number=100, inventory=None,
+                                max_workers=DEFAULT_MAX_WORKERS,
+                                max_rate=None, plan_file=None,
+                                results_file=None):
     """ Clean EBS Snapshots for a given EBS ID
 
         Args:
@@ -97,38 +130,227 @@ def task_clean_snapshots_ebs_id(volume_id, region, hourly_backups=0,
             dry: A boolean stating if the action is simulated or not
             test: run the function with testing snapshots (not real)
             test_number: the number of testing snapshots
+            inventory: A dict with snapshots indexed by volume-id, as
+                       returned by get_snapshots_inventory (optional)
+            max_workers: An integer with the maximum number of snapshots to
+                         delete in parallel
+            max_rate: An integer with the maximum number of snapshots to
+                      delete per second (optional, the default DeleteSnapshot
+                      rate limit if None or 0)
+            plan_file: A string with a path to write the retention plan to,
+                       instead of deleting the snapshots (optional)
+            results_file: A string with a path to stream the results to as
+                          JSON Lines, instead of printing them (optional)
     """
-    if dry is True or test is True:
+    clean_volumes_snapshots([volume_id], region, hourly_backups,
+                            daily_backups, weekly_backups, monthly_backups,
+                            dry, test, test_number, inventory, max_workers,
+                            max_rate, plan_file, results_file)
+
+
+def clean_volumes_snapshots(volume_ids, region, hourly_backups,
+                            daily_backups, weekly_backups, monthly_backups,
+                            dry, test, test_number, inventory, max_workers,
+                            max_rate, plan_file, results_file=None):
+    """ Compute the retention plan for the snapshots of a list of volumes,
+        and write it to a file or execute it
+
+        When streaming the results, each volume is processed as soon as its
+        retention is computed, and the plan is not kept
+
+        Args:
+            volume_ids: A list of strings with the EBS volume-ids
+            See task_clean_snapshots_ebs_id for the rest
+    """
+    plan = RetentionPlan(region, {'hourly': hourly_backups,
+                                  'daily': daily_backups,
+                                  'weekly': weekly_backups,
+                                  'monthly': monthly_backups}, test)
+    if plan_file is not None:
+        results_file = None
+    deleter = None
+    if results_file is not None and test is False:
+        deleter = SnapshotDeleter(region, dry, max_workers, max_rate)
+    with open_results(results_file) as results:
+        try:
+            for volume_id in volume_ids:
+                if test is True:
+                    print_info("Running in test mode (no real snapshots)")
+                else:
+                    print_info("Computing retention for volume-id %s"
+                               % (volume_id))
+                start = time()
+                snapshots = plan_snapshots_by_volume_id(
+                    volume_id, region, hourly_backups, daily_backups,
+                    weekly_backups, monthly_backups, test, test_number,
+                    inventory)
+                if test is True:
+                    print_info("Retention for %s snapshots computed in %.3f "
+                               "seconds" % (len(snapshots), time() - start))
+                if results is not None:
+                    stream_retention(volume_id, snapshots, dry or test,
+                                     deleter, results)
+                else:
+                    plan.add(volume_id, snapshots)
+        finally:
+            if deleter is not None:
+                deleter.shutdown()
+        if results is not None:
+            print_results_summary(results)
+            return
+    if plan_file is not None:
+        plan.write(plan_file)
+        print_ok("Retention plan written to %s, %s snapshots to delete"
+                 % (plan_file, plan.deletions()))
+    else:
+        execute_retention_plan(plan, dry, max_workers, max_rate)
+
+
+def task_execute_retention_plan(plan_file, dry=True,
+                                max_workers=DEFAULT_MAX_WORKERS,
+                                max_rate=None, results_file=None):
+    """ Delete the snapshots from a retention plan written by a previous run,
+        without listing the snapshots again
+
+        Args:
+            plan_file: A string with the path of the retention plan
+            dry: A boolean stating if the action is simulated or not
+            max_workers: An integer with the maximum number of snapshots to
+                         delete in parallel
+            max_rate: An integer with the maximum number of snapshots to
+                      delete per second (optional, the default DeleteSnapshot
+                      rate limit if None or 0)
+            results_file: A string with a path to stream the results to as
+                          JSON Lines, instead of printing them (optional)
+    """
+    plan = read_plan(plan_file)
+    print_info("Executing retention plan %s, %s snapshots to delete"
+               % (plan_file, plan.deletions()))
+    with open_results(results_file) as results:
+        execute_retention_plan(plan, dry, max_workers, max_rate, results)
+
+
+def execute_retention_plan(plan, dry, max_workers, max_rate, results=None):
+    """ Delete the snapshots not to be saved from a retention plan, in
+        parallel by a single pool for all the volumes
+
+        Args:
+            plan: A plan.RetentionPlan object
+            dry: A boolean stating if the action is simulated or not
+            max_workers: An integer with the maximum number of snapshots to
+                         delete in parallel
+            max_rate: An integer with the maximum number of snapshots to
+                      delete per second (optional, the default DeleteSnapshot
+                      rate limit if None or 0)
+            results: A results.ResultStream object to stream the results
+                     to, instead of printing them (optional)
+    """
+    deleter = None
+    if plan.test is False:
+        deleter = SnapshotDeleter(plan.region, dry, max_workers, max_rate)
+    try:
+        for volume_id, snapshots in plan.volumes:
+            if results is not None:
+                stream_retention(volume_id, snapshots, dry or plan.test,
+                                 deleter, results)
+            elif deleter is not None:
+                delete_unsaved_snapshots(snapshots, plan.region, dry,
+                                         deleter)
+    finally:
+        if deleter is not None:
+            deleter.shutdown()
+    if results is not None:
+        print_results_summary(results)
+        return
+    for volume_id, snapshots in plan.volumes:
+        print_clean_results(volume_id, snapshots, dry or plan.test)
+
+
+def stream_retention(volume_id, snapshots, dry, deleter, results):
+    """ Stream the retention decisions for the snapshots of a volume: the
+        saved snapshots at once, and the deleted ones as soon as each
+        deletion is finished
+
+        Args:
+            volume_id: A string with the EBS volume-id
+            snapshots: A list of retention.SnapshotRecord objects, as
+                       returned by plan_snapshots_by_volume_id
+            dry: A boolean stating if the action is simulated or not
+            deleter: A SnapshotDeleter object to queue the deletions at, or
+                     None to not delete the snapshots (test mode)
+            results: A results.ResultStream object
+    """
+    deleted = partial(results.snapshot_deleted, volume_id, dry=dry)
+    for snapshot in snapshots:
+        if snapshot.type is not None:
+            results.snapshot_saved(volume_id, snapshot)
+        elif deleter is None:
+            deleted(snapshot)
+        else:
+            deleter.delete(snapshot, deleted)
+
+
+def print_results_summary(results):
+    """ Print the number of results streamed for each event
+
+        Args:
+            results: A results.ResultStream object
+    """
+    counts = ", ".join(["%s %s" % (count, event) for event, count
+                        in sorted(results.counts.iteritems())])
+    if not counts:
+        counts = "no snapshots"
+    print_ok("Results written to %s: %s" % (results.path, counts))
+    if results.errors > 0:
+        print_error("%s snapshots could not be deleted, see %s"
+                    % (results.errors, results.path))
+
+
+def print_clean_results(volume_id, snapshots, dry):
+    """ Print the saved and deleted snapshots for a volume
+
+        Args:
+            volume_id: A string with the EBS volume-id
+            snapshots: A list of retention.SnapshotRecord objects, as
+                       returned by clean_snapshots_by_volume_id (after the
+                       deletions are finished)
+            dry: A boolean stating if the action was simulated or not
+    """
+    if dry is True:
         drytext = "[DRY] "
     else:
         drytext = ""
-    if test is True:
-        print_info("Running in test mode (no real snapshots)")
-    else:
-        print_info("Cleaning snapshots for volume-id %s" % (volume_id))
-    snapshots = clean_snapshots_by_volume_id(volume_id, region, hourly_backups,
-                                             daily_backups, weekly_backups,
-                                             monthly_backups, dry, test,
-                                             test_number)
     for snapshot in snapshots:
-        if snapshot['type'] is not None:
+        if snapshot.type is not None:
             print_info("Saved snapshot %s, date %s, type %s"
-                       % (snapshot['snapshot_id'],
-                          snapshot['start_time'], snapshot['type']))
+                       % (snapshot.id, snapshot.start_time, snapshot.type))
     for snapshot in snapshots:
-        if snapshot['type'] is None:
-            if snapshot['error'] is None:
+        if snapshot.type is None:
+            if snapshot.error is None:
                 print_info("%sDeleted snapshot %s, date %s"
-                           % (drytext, snapshot['snapshot_id'],
-                              snapshot['start_time']))
+                           % (drytext, snapshot.id, snapshot.start_time))
             else:
                 print_error("It was not possible to delete snapshot %s, "
-                            "error: %s" % (snapshot['snapshot_id'],
-                                           snapshot['error']))
+                            "error: %s" % (snapshot.id, snapshot.error))
     print_ok("Unneeded snapshots for %s deleted" % volume_id)
 
 
-class Snapshot(Thread):
+def check_parallel_tasks(futures):
+    """ Wait for parallel tasks and report the ones that failed
+
+    Args:
+        futures: A list of workers.Future objects, named by volume-id
+    Raises:
+        ParallelTasksFailed: If any of the tasks failed
+    """
+    failed = failed_futures(futures)
+    for future in failed:
+        print_error("Task for %s failed: %s" % (future.name, future.error()))
+    if len(failed) > 0:
+        raise ParallelTasksFailed(len(failed), len(futures))
+
+
+class Snapshot(object):
     """ Object to Perform parallel snapshots
 
     Properties:
@@ -139,26 +361,29 @@ class Snapshot(Thread):
         description: A string with the value for the description
         savetags: A boolean (True to copy tag volumes to snapshot, except
                    Name)
+        results: A results.ResultStream object to stream the new snapshot
+                 to (optional)
     """
 
     def __init__(self, volume_id, region, dry, volume_name, description,
-                 savetags):
-        Thread.__init__(self)
+                 savetags, results=None):
         self.volume_id = volume_id
         self.region = region
         self.dry = dry
         self.volume_name = volume_name
         self.description = description
         self.savetags = savetags
+        self.results = results
 
     def run(self):
-        task_create_snapshot_ebs_id(self.volume_id, self.region, self.dry,
-                                    self.volume_name, self.description,
-                                    self.savetags)
+        return(create_volume_snapshot(self.volume_id, self.region, self.dry,
+                                      self.volume_name, self.description,
+                                      self.savetags, self.results))
 
 
 def task_create_snapshot_ebs_id(volume_id, region, dry, name=None,
-                                description=None, savetags=False):
+                                description=None, savetags=False,
+                                results_file=None):
     """ Make a snapshot from a given volume-id
 
     Args:
@@ -169,6 +394,25 @@ def task_create_snapshot_ebs_id(volume_id, region, dry, name=None,
         description: A string with the value for the new tag
         savetags: A boolean (True to copy tag volumes to snapshot, except
                    Name)
+        results_file: A string with a path to stream the new snapshot to as
+                      JSON Lines (optional)
+    Returns:
+        A string with the snapshots' ID or None for a dry run
+    """
+    with open_results(results_file) as results:
+        return(create_volume_snapshot(volume_id, region, dry, name,
+                                      description, savetags, results))
+
+
+def create_volume_snapshot(volume_id, region, dry, name=None,
+                           description=None, savetags=False, results=None):
+    """ Make a snapshot from a given volume-id, streaming it to a results
+        stream
+
+    Args:
+        results: A results.ResultStream object to stream the new snapshot
+                 to (optional)
+        See task_create_snapshot_ebs_id for the rest
     Returns:
         A string with the snapshots' ID or None for a dry run
     """
@@ -180,6 +424,8 @@ def task_create_snapshot_ebs_id(volume_id, region, dry, name=None,
                % (drytext, volume_id, description))
     snapshot = create_snapshot_by_volume_id(volume_id, region, dry, name,
                                             description, savetags)
+    if results is not None:
+        results.snapshot_created(volume_id, snapshot, dry, description)
     if dry is True:
         snapshot_id = None
         print_ok("%sSnapshot was not created because dry flag is "
@@ -193,7 +439,9 @@ def task_create_snapshot_ebs_id(volume_id, region, dry, name=None,
 def task_create_snapshots_ec2(region, instance_id=None, instance_name=None,
                               parallel=False, dry=True, devices=None,
                               volume_name=None, name=None, description=None,
-                              savetags=False):
+                              savetags=False,
+                              max_workers=DEFAULT_MAX_WORKERS,
+                              results_file=None):
     """ Make a snapshots for volumes attached to an EC2 instance, by device or
         by tag name
 
@@ -209,8 +457,37 @@ def task_create_snapshots_ec2(region, instance_id=None, instance_name=None,
         description: A string with the value for the new tag
         savetags: A boolean (True to copy tag volumes to snapshot, except
                    Name)
+        max_workers: An integer with the maximum number of parallel tasks
+        results_file: A string with a path to stream the new snapshots to as
+                      JSON Lines (optional)
     Returns:
-        A string with the snapshots' ID or None for a dry run
+        A dict with volume-ids as keys and the snapshots' IDs (or None for a
+        dry run) as values
+    Raises:
+        ParallelTasksFailed: If any of the parallel snapshots failed
+    """
+    with open_results(results_file) as results:
+        return(create_volumes_snapshots(region, instance_id, instance_name,
+                                        parallel, dry, devices, volume_name,
+                                        name, description, savetags,
+                                        max_workers, results))
+
+
+def create_volumes_snapshots(region, instance_id, instance_name, parallel,
+                             dry, devices, volume_name, name, description,
+                             savetags, max_workers, results):
+    """ Make a snapshots for volumes attached to an EC2 instance, streaming
+        them to a results stream
+
+    Args:
+        results: A results.ResultStream object to stream the new snapshots
+                 to (optional)
+        See task_create_snapshots_ec2 for the rest
+    Returns:
+        A dict with volume-ids as keys and the snapshots' IDs (or None for a
+        dry run) as values
+    Raises:
+        ParallelTasksFailed: If any of the parallel snapshots failed
     """
     volumes = []
     if instance_name is not None:
@@ -223,32 +500,98 @@ def task_create_snapshots_ec2(region, instance_id=None, instance_name=None,
     if volume_name is not None:
         volumes = get_volumes_from_instance_by_name(instance.id, volume_name,
                                                     region)
+    snapshots = {}
+    futures = []
     if parallel:
         print_special("===================================")
         print_special("     STARTING PARALLEL TASKS       ")
         print_special("===================================")
+        pool = WorkerPool(max_workers)
     for volume in volumes:
         if parallel:
             task = Snapshot(volume.id, region, dry, name, description,
-                            savetags)
-            task.start()
+                            savetags, results)
+            futures.append(pool.submit(volume.id, task.run))
         else:
-            task_create_snapshot_ebs_id(volume.id, region, dry, name,
-                                        description, savetags)
+            snapshots[volume.id] = create_volume_snapshot(
+                volume.id, region, dry, name, description, savetags,
+                results)
     # Main thread
     if parallel:
-        main_thread = currentThread()
-        for thread in enumerate():
-            # Prevent deadlock
-            if thread is main_thread:
-                continue
-            thread.join()
+        pool.shutdown()
         print_special("===================================")
         print_special("     FINISHED PARALLEL TASKS       ")
         print_special("===================================")
+        check_parallel_tasks(futures)
+        for future in futures:
+            snapshots[future.name] = future.result()
+    return(snapshots)
+
+
+def task_presnapshot_ebs_id(volume, region, dry, savetags=False):
+    """ Make a warm-up snapshot for a volume before migrating it, and wait
+        till it is finished
+
+    Args:
+        volume: A boto.ec2.volume.Volume with the volume to snapshot
+        region: A string with the AWS region where the volume is
+        dry: A boolean stating if the action is simulated or not
+        savetags: A boolean (True to copy tag volumes to snapshot, except
+                   Name)
+    Returns:
+        A string with the snapshot's ID or None for a dry run
+    """
+    description = "Pre-migration snapshot (%s %s)" % (
+        volume.attach_data.instance_id, volume.attach_data.device)
+    snapshot_id = task_create_snapshot_ebs_id(volume.id, region, dry,
+                                              description=description,
+                                              savetags=savetags)
+    if dry is False:
+        print_info("Waiting for snapshot %s to be available..."
+                   % snapshot_id)
+        snapshot_wait_creation(snapshot_id, region)
+        print_ok("Snapshot %s is available" % snapshot_id)
+    return(snapshot_id)
 
 
-class VolumeMigrate(Thread):
+def presnapshot_volumes(region, dry, volumes, savetags=False,
+                        max_workers=DEFAULT_MAX_WORKERS):
+    """ Make warm-up snapshots for EBS volumes in parallel, while the
+        instance is still running. As EBS snapshots are incremental, the
+        snapshots made after stopping the instance will only contain the
+        changes since these ones, and will finish quickly
+
+    Args:
+        region: A string with the AWS region where the volumes are
+        dry: A boolean stating if the action is simulated or not
+        volumes: A list of boto.ec2.volume.Volume to snapshot
+        savetags: A boolean (True to copy tag volumes to snapshot, except
+                   Name)
+        max_workers: An integer with the maximum number of parallel
+                     snapshots
+    Returns:
+        A dict with volume-ids as keys and the snapshots' IDs (or None for a
+        dry run) as values
+    Raises:
+        ParallelTasksFailed: If any of the snapshots failed
+    """
+    print_special("===================================")
+    print_special("   STARTING PARALLEL PRESNAPSHOTS  ")
+    print_special("===================================")
+    pool = WorkerPool(max_workers)
+    futures = []
+    for volume in volumes:
+        futures.append(pool.submit(volume.id, task_presnapshot_ebs_id, volume,
+                                   region, dry, savetags))
+    pool.shutdown()
+    print_special("===================================")
+    print_special("   FINISHED PARALLEL PRESNAPSHOTS  ")
+    print_special("===================================")
+    check_parallel_tasks(futures)
+    return(dict([(future.name, future.result()) for future in futures]))
+
+
+class VolumeMigrate(object):
     """ Object to Perform all needed task to change an EBS volume type
 
     Properties:
@@ -261,26 +604,66 @@ class VolumeMigrate(Thread):
         newpiops: An integer with the new number of PIOPs (only when vtype=io1)
         savetags: A boolean (True to copy tag volumes to snapshot, except
                    Name)
+        spans: A spans.SpanRecorder to record the time of each phase
+        presnapshot_id: A string with the id of the warm-up snapshot of the
+                        volume, deleted once the final snapshot is completed
+                        (optional)
+        tags_error: A CreateTagsError if the tags of the new volume could not
+                    be written
     """
 
-    def __init__(self, region, dry, instance_id, volume, vtype, newpiops, tid,
-                 savetags):
-        Thread.__init__(self)
+    def __init__(self, region, dry, instance_id, volume, vtype, newpiops,
+                 savetags, spans=None, presnapshot_id=None):
         self.region = region
         self.dry = dry
         self.instance_id = instance_id
         self.volume = volume
         self.vtype = vtype
         self.newpiops = newpiops
-        self.tid = tid
         self.savetags = savetags
+        if spans is None:
+            spans = SpanRecorder()
+        self.spans = spans
+        self.presnapshot_id = presnapshot_id
+        self.tags_error = None
+
+    def delete_presnapshot(self):
+        """ Delete the warm-up snapshot, as the final snapshot has all its
+            data. It is kept (with a warning) if it can not be deleted
+        """
+        print_info("Deleting warm-up snapshot %s..." % self.presnapshot_id)
+        try:
+            delete_snapshot_by_id(self.presnapshot_id, self.region, self.dry)
+        except SnapshotDeleteError as e:
+            print_warning("Warm-up snapshot %s was kept: %s"
+                          % (self.presnapshot_id, e.error))
+            return(False)
+        print_ok("Warm-up snapshot %s was deleted" % self.presnapshot_id)
+        return(True)
+
+    def write_tags(self):
+        """ Write the tags queued by this task, including the ones for the
+            new volume. A failure is reported and saved at tags_error, as it
+            does not make the migration fail
+        """
+        try:
+            flush_tags(self.region)
+        except CreateTagsError as e:
+            print_error("%s" % e)
+            self.tags_error = e
 
     def run(self):
+        try:
+            self.migrate()
+        finally:
+            # The tags for the new volume are queued by create_volume
+            self.write_tags()
+
+    def migrate(self):
         if self.dry is True:
             drytext = "[DRY] "
         else:
             drytext = ""
-        idtext = "[%s] " % self.tid
         # Construct name
         try:
             name = self.volume.tags['Name']
@@ -297,63 +680,158 @@ class VolumeMigrate(Thread):
                                       self.volume.attach_data.instance_id,
                                       self.volume.attach_data.device)
         # Perform Snapshot
-        snapshot_id = task_create_snapshot_ebs_id(self.volume.id, self.region,
-                                                  self.dry,
-                                                  description=description,
-                                                  savetags=self.savetags)
+        with self.spans.span('snapshot', self.volume):
+            snapshot_id = task_create_snapshot_ebs_id(
+                self.volume.id, self.region, self.dry,
+                description=description, savetags=self.savetags)
         if self.dry is False:
-            print_info("%s%sWaiting for snapshot %s to be available..."
-                       % (drytext, idtext, snapshot_id))
-            snapshot_wait_creation(snapshot_id, self.region)
+            print_info("%sWaiting for snapshot %s to be available..."
+                       % (drytext, snapshot_id))
+            with self.spans.span('wait_snapshot', self.volume):
+                snapshot_wait_creation(snapshot_id, self.region)
+            if self.presnapshot_id is not None:
+                self.delete_presnapshot()
         # Detach volume
-        print_info("%s%sDettaching volume %s..." % (drytext, idtext,
-                                                    self.volume.id))
-        detach_volume(self.volume.id, self.region, self.dry)
+        print_info("%sDettaching volume %s..." % (drytext, self.volume.id))
+        with self.spans.span('detach', self.volume):
+            detach_volume(self.volume.id, self.region, self.dry)
         if self.dry is True:
-            print_ok("%s%sVolume %s was not dettached because dry flag is "
-                     "enabled" % (drytext, idtext, self.volume.id))
+            print_ok("%sVolume %s was not dettached because dry flag is "
+                     "enabled" % (drytext, self.volume.id))
         else:
-            print_ok("%sVolume %s was dettached" % (idtext, self.volume.id))
+            print_ok("Volume %s was dettached" % self.volume.id)
         # Create volume
-        print_info("%s%sCreate volume from snapshot %s..." % (drytext, idtext,
-                                                              snapshot_id))
+        print_info("%sCreate volume from snapshot %s..." % (drytext,
+                                                            snapshot_id))
         if self.vtype == "io1":
-            nvolume = create_volume(self.volume.region, self.dry,
-                                    self.volume.zone, self.volume.size,
-                                    self.vtype, self.newpiops, name,
-                                    self.volume.tags, self.volume.encrypted,
-                                    snapshot_id, self.savetags)
-        if self.vtype == "standard" or self.vtype == "gp2":
-            nvolume = create_volume(self.volume.region, self.dry,
+            piops = self.newpiops
+        else:
+            piops = None
+        with self.spans.span('create', self.volume):
+            nvolume = create_volume(self.region, self.dry,
                                     self.volume.zone, self.volume.size,
-                                    self.vtype, None, name,
+                                    self.vtype, piops, name,
                                     self.volume.tags, self.volume.encrypted,
                                     snapshot_id, self.savetags)
         if self.dry is True:
-            print_ok("%s%sVolume was not created because dry flag is enabled"
-                     % (drytext, idtext))
-            print_ok("%s%sNot attaching new volume, as this is a dry run"
-                     % (drytext, idtext))
+            print_ok("%sVolume was not created because dry flag is enabled"
+                     % drytext)
+            print_ok("%sNot attaching new volume, as this is a dry run"
+                     % drytext)
         else:
-            print_ok("%sVolume %s was created from snapshot %s"
-                     % (idtext, nvolume.id, snapshot_id))
+            print_ok("Volume %s was created from snapshot %s"
+                     % (nvolume.id, snapshot_id))
             # Attach volume
-            print_info("%sAttaching volume %s to %s as %s..."
-                       % (idtext, nvolume.id,  self.instance_id,
+            print_info("Attaching volume %s to %s as %s..."
+                       % (nvolume.id,  self.instance_id,
                           self.volume.attach_data.device))
-            attach_volume(nvolume.id, self.instance_id,
-                          self.volume.attach_data.device, self.region,
-                          self.dry)
-        print_info("%s%sDeleting old volume %s..." % (drytext, idtext,
-                                                      self.volume.id))
-        delete_volume(self.volume.id, self.region, self.dry)
+            with self.spans.span('attach', self.volume):
+                attach_volume(nvolume.id, self.instance_id,
+                              self.volume.attach_data.device, self.region,
+                              self.dry)
+        print_info("%sDeleting old volume %s..." % (drytext, self.volume.id))
+        with self.spans.span('delete', self.volume):
+            delete_volume(self.volume.id, self.region, self.dry)
         if self.dry is True:
-            print_ok("%s%sOld volume %s was not deleted because dry flag is "
-                     "enabled" % (drytext, idtext, self.volume.id))
+            print_ok("%sOld volume %s was not deleted because dry flag is "
+                     "enabled" % (drytext, self.volume.id))
         else:
-            print_ok("%sOld volume %s was deleted, but remember you still "
+            print_ok("Old volume %s was deleted, but remember you still "
                      "have its snapshot in case there're problems!"
-                     % (idtext, self.volume.id))
+                     % self.volume.id)
+
+
+class VolumeModify(object):
+    """ Object to change an EBS volume type in place, without stopping the
+        instance
+
+    Properties:
+        region: A string with the AWS region where the volume is
+        dry: A boolean stating if the action is simulated or not
+        volume: A boto.ec2.volume.Volume with the volume to change
+        vtype: A string with the new volume type (io1|gp2)
+        newpiops: An integer with the new number of PIOPs (only when vtype=io1)
+        spans: A spans.SpanRecorder to record the time of each phase
+    """
+
+    def __init__(self, region, dry, volume, vtype, newpiops, spans=None):
+        self.region = region
+        self.dry = dry
+        self.volume = volume
+        self.vtype = vtype
+        self.newpiops = newpiops
+        if spans is None:
+            spans = SpanRecorder()
+        self.spans = spans
+
+    def run(self):
+        if self.dry is True:
+            drytext = "[DRY] "
+        else:
+            drytext = ""
+        print_info("%sModifying volume %s to %s..." % (drytext,
+                                                       self.volume.id,
+                                                       self.vtype))
+        with self.spans.span('modify', self.volume):
+            modify_volume(self.volume, self.region, self.dry, self.vtype,
+                          self.newpiops)
+        if self.dry is True:
+            print_ok("%sVolume %s was not modified because dry flag is "
+                     "enabled" % (drytext, self.volume.id))
+            return(None)
+        print_info("Waiting for modification of volume %s..."
+                   % self.volume.id)
+        with self.spans.span('wait_modification', self.volume):
+            modification = volume_modification_wait(self.volume.id,
+                                                    self.region)
+        print_ok("Volume %s was modified to %s (%s, %s%%)"
+                 % (self.volume.id, modification.target_type,
+                    modification.state, modification.progress))
+        return(modification)
+
+
+def modify_volumes(region, dry, volumes, vtype, newpiops=None,
+                   max_workers=DEFAULT_MAX_WORKERS, spans=None):
+    """ Change type for EBS volumes in place, in parallel
+
+    Args:
+        region: A string with the AWS region where the volumes are
+        dry: A boolean stating if the action is simulated or not
+        volumes: A list of boto.ec2.volume.Volume to change
+        vtype: A string with the new volume type (io1|standard|gp2)
+        newpiops: An integer with the new number of PIOPs (only when vtype=io1)
+        max_workers: An integer with the maximum number of parallel
+                     modifications
+        spans: A spans.SpanRecorder to record the time of each phase
+               (optional)
+    Returns:
+        A list of boto.ec2.volume.Volume objects that can not be modified in
+        place
+    Raises:
+        ParallelTasksFailed: If any of the modifications failed
+    """
+    print_special("===================================")
+    print_special("  STARTING PARALLEL MODIFICATIONS  ")
+    print_special("===================================")
+    pool = WorkerPool(max_workers)
+    futures = []
+    for volume in volumes:
+        task = VolumeModify(region, dry, volume, vtype, newpiops, spans)
+        futures.append(pool.submit(volume.id, task.run))
+    pool.shutdown()
+    print_special("===================================")
+    print_special("  FINISHED PARALLEL MODIFICATIONS  ")
+    print_special("===================================")
+    unavailable = []
+    modified = []
+    for volume, future in zip(volumes, futures):
+        if isinstance(future.error(), VolumeModificationUnavailable):
+            print_warning(future.error())
+            unavailable.append(volume)
+        else:
+            modified.append(future)
+    check_parallel_tasks(modified)
+    return(unavailable)
 
 
 def check_migration_logic(volumes, vtype, newpiops, region):
@@ -398,8 +876,39 @@ def check_migration_logic(volumes, vtype, newpiops, region):
     return(True)
 
 
+def print_critical_path(spans):
+    """ Print the time of each phase of a migration, and the phases that
+        determined its length
+
+    Args:
+        spans: A spans.SpanRecorder with the phases of the migration
+    """
+    print_special("===================================")
+    print_special("          MIGRATION PHASES         ")
+    print_special("===================================")
+    for name, phase in sorted(spans.phases().iteritems()):
+        if phase['seconds_per_gb'] is None:
+            per_gb = ""
+        else:
+            per_gb = ", %ss/GB" % phase['seconds_per_gb']
+        print_info("%s: %s times, %ss mean, %ss max%s"
+                   % (name, phase['count'], phase['mean_seconds'],
+                      phase['max_seconds'], per_gb))
+    downtime = spans.elapsed('stop_instance', 'start_instance')
+    if downtime is not None:
+        print_info("Instance downtime: %ss" % round(downtime, 3))
+    path = spans.critical_path()
+    print_info("Critical path: %ss (last volume: %s)"
+               % (path['seconds'], path['volume_id']))
+    for phase in path['phases']:
+        print_info("  %s: %ss (%s%%)" % (phase['name'], phase['seconds'],
+                                         round(phase['share'] * 100, 1)))
+
+
 def migrate_volumes(region, dry, devices, vtype, newpiops=None,
-                    instance_id=None, instance_name=None, savetags=False):
+                    instance_id=None, instance_name=None, savetags=False,
+                    max_workers=DEFAULT_MAX_WORKERS, inplace=False,
+                    presnapshot=False, spans_output=None):
     """ Change type for all EBS volumes attached to an EC2 instance
 
     Args:
@@ -412,8 +921,25 @@ def migrate_volumes(region, dry, devices, vtype, newpiops=None,
                      attached
         savetags: A boolean (True to copy tag volumes to snapshot, except
                    Name)
+        max_workers: An integer with the maximum number of parallel
+                     migrations
+        inplace: A boolean (True to change the volumes in place without
+                 stopping the instance, and migrate with snapshots only the
+                 volumes that can not be modified)
+        presnapshot: A boolean (True to make warm-up snapshots while the
+                     instance is running, so the instance is stopped only
+                     while the final incremental snapshots are made. They
+                     are deleted once the final snapshots are completed)
+        spans_output: A string with the path of a JSON file to write the
+                      time of each phase of the migration to, and print a
+                      summary of the critical path (optional)
     Returns:
         True if all the volumes were migrated
+    Raises:
+        ParallelTasksFailed: If any of the migrations failed (the instance
+                             is not started again in that case)
+        CreateTagsError: If the tags of any new volume could not be written
+                         (the instance is started again in that case)
     """
     if vtype not in ['gp2', 'io1', 'standard']:
         raise InvalidVolumeType(vtype)
@@ -427,39 +953,70 @@ def migrate_volumes(region, dry, devices, vtype, newpiops=None,
         instance = get_instance_by_id(instance_id, region)
     volumes = get_volumes_from_instance_by_device(instance.id, devices, region)
     check_migration_logic(volumes, vtype, newpiops, region)
-    print_info
-    print_info("%sStopping instance..." % drytext)
-    was_started = stop_instance_and_wait(instance.id, region, dry)
-    if was_started is True:
-        print_ok("%sInstance stopped" % drytext)
-    else:
-        print_ok("%sNot stopping instance as it was stopped" % drytext)
-    print_special("===================================")
-    print_special("     STARTING PARALLEL CHANGES     ")
-    print_special("===================================")
-    tid = 0
-    for volume in volumes:
-        task = VolumeMigrate(region, dry, instance.id, volume, vtype, newpiops,
-                             tid, savetags)
-        task.start()
-        tid += 1
-    # Main thread
-    main_thread = currentThread()
-    for thread in enumerate():
-        # Prevent deadlock
-        if thread is main_thread:
-            continue
-        thread.join()
-    print_special("===================================")
-    print_special("     FINISHED PARALLEL CHANGES     ")
-    print_special("===================================")
-    print_ok("%sAll volumes were successfully changed" % drytext)
-    if was_started is True:
-        print_info("%sStarting instance..." % drytext)
-        was_stopped = start_instance_and_wait(instance.id, region, dry)
-        print_ok("%sInstance started" % drytext)
-    else:
-        print_ok("%sNot starting %s as it was stopped before the migration"
-                 % (drytext, instance.id))
-    print_ok("All tasks finished!")
-    return(True)
+    spans = SpanRecorder()
+    try:
+        if inplace is True:
+            volumes = modify_volumes(region, dry, volumes, vtype, newpiops,
+                                     max_workers, spans)
+            if len(volumes) == 0:
+                print_ok("%sAll volumes were successfully changed"
+                         % drytext)
+                print_ok("All tasks finished!")
+                return(True)
+            print_warning("%s%s volumes will be migrated using snapshots"
+                          % (drytext, len(volumes)))
+        presnapshots = {}
+        if presnapshot is True:
+            if instance.state == "running":
+                with spans.span('presnapshot'):
+                    presnapshots = presnapshot_volumes(region, dry, volumes,
+                                                       savetags, max_workers)
+            else:
+                print_info("%sNot making warm-up snapshots as the instance "
+                           "is not running" % drytext)
+        print_info("%sStopping instance..." % drytext)
+        with spans.span('stop_instance'):
+            was_started = stop_instance_and_wait(instance.id, region, dry)
+        if was_started is True:
+            print_ok("%sInstance stopped" % drytext)
+        else:
+            print_ok("%sNot stopping instance as it was stopped" % drytext)
+        print_special("===================================")
+        print_special("     STARTING PARALLEL CHANGES     ")
+        print_special("===================================")
+        pool = WorkerPool(max_workers)
+        futures = []
+        tasks = []
+        for volume in volumes:
+            task = VolumeMigrate(region, dry, instance.id, volume, vtype,
+                                 newpiops, savetags, spans,
+                                 presnapshots.get(volume.id))
+            tasks.append(task)
+            futures.append(pool.submit(volume.id, task.run))
+        # Main thread
+        pool.shutdown()
+        print_special("===================================")
+        print_special("     FINISHED PARALLEL CHANGES     ")
+        print_special("===================================")
+        check_parallel_tasks(futures)
+        print_ok("%sAll volumes were successfully changed" % drytext)
+        if was_started is True:
+            print_info("%sStarting instance..." % drytext)
+            with spans.span('start_instance'):
+                was_stopped = start_instance_and_wait(instance.id, region,
+                                                      dry)
+            print_ok("%sInstance started" % drytext)
+        else:
+            print_ok("%sNot starting %s as it was stopped before the "
+                     "migration" % (drytext, instance.id))
+        # Tags that could not be written do not keep the instance stopped,
+        # but make the run fail once it is started again
+        for task in tasks:
+            if task.tags_error is not None:
+                raise task.tags_error
+        print_ok("All tasks finished!")
+        return(True)
+    finally:
+        if spans_output is not None:
+            spans.write(spans_output)
+            print_critical_path(spans)
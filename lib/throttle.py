@@ -0,0 +1,170 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from apiprofile import get_profile
+from boto.exception import BotoServerError
+from random import uniform
+from threading import Lock
+from time import sleep, time
+
+# Error codes returned by EC2 when the request rate is too high
+THROTTLING_ERRORS = ('RequestLimitExceeded', 'Throttling')
+
+# Retries for throttled calls, and base and maximum backoff (seconds)
+MAX_RETRIES = 8
+BASE_DELAY = 0.5
+MAX_DELAY = 30
+
+# Minimum rate (requests per second) a bucket can be slowed down to
+MIN_RATE = 0.5
+
+# Sustained rate (requests per second) and burst for each API action
+DEFAULT_RATE = (5, 20)
+ACTION_RATES = {
+    # Also caps the rate for the whole run at SnapshotDeleter
+    'DeleteSnapshot': (50, 100),
+    'DescribeInstances': (20, 100),
+    'DescribeSnapshots': (20, 100),
+    'DescribeVolumes': (20, 100),
+}
+
+_buckets = {}
+_buckets_lock = Lock()
+
+
+class TokenBucket(object):
+    """ Token bucket rate limiter, slowed down when the API throttles
+        requests and sped up again while requests succeed
+
+    Properties:
+        max_rate: A float with the configured requests per second
+        rate: A float with the current requests per second
+        burst: A float with the maximum number of tokens in the bucket
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.timestamp = time()
+        self.lock = Lock()
+
+    def acquire(self):
+        """ Take a token from the bucket, waiting until it is available """
+        with self.lock:
+            now = time()
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            sleep(wait)
+
+    def throttled(self):
+        """ Halve the rate after a throttling error """
+        with self.lock:
+            self.rate = max(MIN_RATE, self.rate / 2)
+
+    def succeeded(self):
+        """ Recover part of the configured rate after a successful call """
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def set_action_rate(action, rate, burst=None):
+    """ Tune the rate limit for an API action
+
+    Args:
+        action: A string with the API action (for example CreateSnapshot)
+        rate: A number with the sustained requests per second
+        burst: An integer with the maximum burst of requests (optional,
+               defaults to the rate)
+    """
+    if burst is None:
+        burst = rate
+    with _buckets_lock:
+        ACTION_RATES[action] = (rate, burst)
+        for key in [key for key in _buckets if key[1] == action]:
+            del _buckets[key]
+
+
+def get_bucket(region, action):
+    """ Get the token bucket for an API action in a region
+
+    Args:
+        region: A string with the AWS region
+        action: A string with the API action
+    Returns:
+        A TokenBucket object
+    """
+    with _buckets_lock:
+        bucket = _buckets.get((region, action))
+        if bucket is None:
+            rate, burst = ACTION_RATES.get(action, DEFAULT_RATE)
+            bucket = _buckets[(region, action)] = TokenBucket(rate, burst)
+    return(bucket)
+
+
+def throttled_call(region, action, function, *args, **kwargs):
+    """ Call a function performing an API action, respecting the rate limit
+        for the action and retrying with jittered exponential backoff if
+        the request is throttled
+
+    Args:
+        region: A string with the AWS region
+        action: A string with the API action
+        function: The function to call
+        *args, **kwargs: The arguments for the function
+    Returns:
+        The value returned by the function
+    Raises:
+        boto.exception.BotoServerError: If the call failed, or if it was
+                                        still throttled after all retries
+    """
+    bucket = get_bucket(region, action)
+    profile = get_profile()
+    attempt = 0
+    while True:
+        start = time()
+        bucket.acquire()
+        called = time()
+        try:
+            result = function(*args, **kwargs)
+        except BotoServerError as e:
+            throttled = e.error_code in THROTTLING_ERRORS
+            if profile is not None:
+                profile.record_call(region, action, time() - called,
+                                    called - start, not throttled)
+            if not throttled or attempt >= MAX_RETRIES:
+                raise
+            bucket.throttled()
+            delay = uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+            if profile is not None:
+                profile.record_retry(region, action, delay)
+            sleep(delay)
+            attempt += 1
+        else:
+            if profile is not None:
+                profile.record_call(region, action, time() - called,
+                                    called - start, False)
+            bucket.succeeded()
+            return(result)
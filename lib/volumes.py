@@ -19,19 +19,85 @@
 
 
 from boto.exception import EC2ResponseError
-from connection import ec2conn
+from cache import cache_invalidate, cache_store, memoize
+from connection import MODERN_API_VERSION, api_version, ec2conn
+from exceptions import CreateTagsError
 from exceptions import ErrorAttachingVolume, ErrorCreatingVolume
 from exceptions import ErrorDeletingVolume, ErrorDetachingVolume
+from exceptions import ErrorModifyingVolume
 from exceptions import InvalidPIOPSRatio, InvalidPIOPSValue
 from exceptions import InvalidVolume, InvalidVolumeID, InvalidVolumeType
 from exceptions import NoMatchingVolumesByDevice, NoMatchingVolumesByName
-from exceptions import NoVolumes, VolumeCreateTagError
-from exceptions import VolumeFetchError, VolumeNotAttached
+from exceptions import NoVolumes
+from exceptions import VolumeFetchError, VolumeModificationUnavailable
+from exceptions import VolumeCreateTagError, VolumeNotAttached
 from re import compile
 from snapshots import get_snapshot_by_id
-from time import sleep
+from tags import flush_tags, queue_tags
+from waiter import wait_for
 
+# Errors for ModifyVolume meaning the volume can not be modified in place
+MODIFY_UNAVAILABLE_ERRORS = ('IncorrectModificationState',
+                             'UnsupportedOperation')
 
+
+class VolumeModification(object):
+    """ Object to parse EBS volume modifications from EC2 API responses
+
+    Properties:
+        id: A string with the volume id
+        state: A string with the modification state (modifying, optimizing,
+               completed or failed)
+        progress: An integer with the progress of the modification (%)
+        target_type: A string with the new volume type
+        target_iops: An integer with the new number of PIOPs
+        status_message: A string with the status, if the modification failed
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection
+        self.id = None
+        self.state = None
+        self.progress = None
+        self.target_type = None
+        self.target_iops = None
+        self.status_message = None
+
+    def startElement(self, name, attrs, connection):
+        return(None)
+
+    def endElement(self, name, value, connection):
+        if name == 'volumeId':
+            self.id = value
+        elif name == 'modificationState':
+            self.state = value
+        elif name == 'progress':
+            self.progress = int(value)
+        elif name == 'targetVolumeType':
+            self.target_type = value
+        elif name == 'targetIops':
+            self.target_iops = int(value)
+        elif name == 'statusMessage':
+            self.status_message = value
+
+
+def get_volume_modifications(conn, volume_ids):
+    """ Get the modifications for a list of EBS volumes
+
+    Args:
+        conn: A boto.ec2.connection.EC2Connection object
+        volume_ids: A list of strings with the volume ids
+    Returns:
+        A list of VolumeModification objects
+    """
+    params = {}
+    conn.build_filter_params(params, {'volume-id': list(volume_ids)})
+    with api_version(conn, MODERN_API_VERSION):
+        return(conn.get_list('DescribeVolumesModifications', params,
+                             [('item', VolumeModification)], verb='POST'))
+
+
+@memoize('volume')
 def get_volume_by_id(volume_id, region):
     """ Get an EBS volume for a given volume id
 
@@ -129,6 +195,8 @@ def get_volumes_from_instance(instance_id, region):
             filters={'attachment.instance-id': '%s' % instance_id})
     except Exception as e:
         raise VolumeFetchError(e)
+    for volume in volumes:
+        cache_store('volume', region, volume)
     if len(volumes) > 0:
         return(volumes)
     else:
@@ -175,18 +243,19 @@ def delete_volume(volume_id, region, dry):
         ErrorDeletingVolume: If there was an error deleting the volume
     """
     conn = ec2conn(region)
-    volume = get_volume_by_id(volume_id, region)
+    # Test if the volume exist
+    get_volume_by_id(volume_id, region)
     try:
-        volume.delete(dry)
+        conn.delete_volume(volume_id, dry_run=dry)
     except Exception as e:
         try:
             if 'DryRun flag is set' in e.body:
                 return(True)
         except:
             ErrorDeletingVolume(volume_id, e)
-    while volume.status == "deleting":
-        sleep(10)
-        volume.update(validate=True)
+    cache_invalidate('volume', region, volume_id)
+    wait_for('volume', volume_id, region,
+             lambda v: v is None or v.status != "deleting")
     return(True)
 
 
@@ -209,16 +278,16 @@ def detach_volume(volume_id, region, dry):
     if device is None:
         raise VolumeNotAttached(volume_id)
     try:
-        volume.detach(dry_run=dry)
+        conn.detach_volume(volume_id, dry_run=dry)
     except Exception as e:
         try:
             if 'DryRun flag is set' in e.body:
                 return(True)
         except:
             raise ErrorDetachingVolume(volume_id, e)
-    while volume.attach_data.status is not None:
-        sleep(10)
-        volume.update(validate=True)
+    cache_invalidate('volume', region, volume_id)
+    wait_for('volume', volume_id, region,
+             lambda v: v is None or v.attach_data.status is None)
     return(True)
 
 
@@ -235,37 +304,113 @@ def attach_volume(volume_id, instance_id, device, region, dry):
         ErrorAttachingVolume: If there is a problem attaching the volume
     """
     conn = ec2conn(region)
-    volume = get_volume_by_id(volume_id, region)
     try:
-        volume.attach(instance_id, device, dry)
+        conn.attach_volume(volume_id, instance_id, device, dry_run=dry)
     except Exception as e:
         try:
             if 'DryRun flag is set' in e.body:
                 return(True)
         except:
             raise ErrorAttachingVolume(volume_id, e)
-    while volume.attach_data.status != "attached":
-        sleep(10)
-        volume.update(validate=True)
+    cache_invalidate('volume', region, volume_id)
+    wait_for('volume', volume_id, region,
+             lambda v: v is None or v.attach_data.status == "attached")
+    return(True)
+
+
+def modify_volume(volume, region, dry, vtype, piops=None):
+    """ Change the type (and PIOPs) of an EBS volume in place, without
+        detaching it
+
+    Args:
+        volume: A boto.ec2.volume.Volume with the volume to modify
+        region: A string with the AWS region where the volume is
+        dry: A boolean stating if the action is simulated or not
+        vtype: A string with the new volume type (io1|gp2)
+        piops: An integer with the number of PIOPs (only when vtype=io1)
+    Returns:
+        True if the modification was started
+    Raises:
+        VolumeModificationUnavailable: If the volume can not be modified in
+                                       place
+        ErrorModifyingVolume: If there was an error modifying the volume
+    """
+    # Magnetic volumes do not support modifications
+    if volume.type == "standard" or vtype == "standard":
+        raise VolumeModificationUnavailable(volume.id, 'standard volume type')
+    conn = ec2conn(region)
+    params = {'VolumeId': volume.id, 'VolumeType': vtype}
+    if vtype == "io1":
+        params['Iops'] = piops
+    if dry:
+        params['DryRun'] = 'true'
+    try:
+        with api_version(conn, MODERN_API_VERSION):
+            conn.get_object('ModifyVolume', params, VolumeModification,
+                            verb='POST')
+    except EC2ResponseError as e:
+        if 'DryRun flag is set' in e.body:
+            return(True)
+        elif e.error_code in MODIFY_UNAVAILABLE_ERRORS:
+            raise VolumeModificationUnavailable(volume.id, e.error_message)
+        else:
+            raise ErrorModifyingVolume(volume.id, e)
+    except Exception as e:
+        raise ErrorModifyingVolume(volume.id, e)
+    cache_invalidate('volume', region, volume.id)
     return(True)
 
 
+def volume_modification_wait(volume_id, region):
+    """ Wait till the modification of a volume is in effect (optimizing or
+        completed)
+
+    Args:
+        volume_id: A string with the volume id
+        region: A string with the AWS region where the volume is
+    Returns:
+        A VolumeModification object
+    Raises:
+        ErrorModifyingVolume: If the modification failed
+    """
+    # The modification may not be described yet right after ModifyVolume
+    modification = wait_for('modification', volume_id, region,
+                            lambda m: m is not None and
+                            m.state != "modifying")
+    if modification.state == "failed":
+        raise ErrorModifyingVolume(volume_id, modification.status_message)
+    return(modification)
+
+
 def create_volume_tags(volume_id, region, tags):
     """ Create a new tags for the given volume-id
+
+        Tags are written together with the other tags queued by this thread
+        for the region (see tags.flush_tags)
+
     Args:
         volume_id: A string with the volume-id for the volume
         region: A string with the AWS region where the volume is
         tags:  A python dictionary with tags for the new volume
     Returns:
         True if the operation succeeded
+    Raises:
+        VolumeCreateTagError: If it was not possible to create the tags
     """
-    for key, value in tags.iteritems():
-        create_volume_tag(volume_id, region, key, value)
+    queue_tags(volume_id, region, tags)
+    try:
+        flush_tags(region)
+    except CreateTagsError as e:
+        raise VolumeCreateTagError(e)
     return(True)
 
 
 def create_volume_tag(volume_id, region, tagname, value):
     """ Create a new tag for the given volume-id
+
+        The tag is written together with the other tags queued by this
+        thread for the region (see tags.flush_tags)
+
     Args:
         volume_id: A string with the volume-id for the volume
         region: A string with the AWS region where the volume is
@@ -276,12 +421,7 @@ def create_volume_tag(volume_id, region, tagname, value):
     Raises:
         VolumeCreateTagError: If it was not possible to create the tag
     """
-    try:
-        conn = ec2conn(region)
-        conn.create_tags(volume_id, {"%s" % tagname: "%s" % value})
-    except Exception as e:
-        raise VolumeCreateTagError(e)
-    return(True)
+    return(create_volume_tags(volume_id, region, {tagname: value}))
 
 
 def create_volume(region, dry, zone, size, vtype, piops=None, name=None,
@@ -304,7 +444,8 @@ def create_volume(region, dry, zone, size, vtype, piops=None, name=None,
                    value from the snapshot)
         snapshot_id: A string with the snapshot-id for the snapshot
     Returns:
-        A boto.ec2.volume.Volume object if the operation was successful
+        A boto.ec2.volume.Volume object if the operation was successful. Its
+        tags are queued, and written by tags.flush_tags from the same thread
     Raises:
         ErrorCreatingVolume: If there is a problem creating the volume
     """
@@ -329,17 +470,22 @@ def create_volume(region, dry, zone, size, vtype, piops=None, name=None,
     if volume.status == "error":
         raise ErrorCreatingVolume("Error creating volume: volume status is "
                                   "error")
-    while volume.status == "creating":
-        sleep(15)
-        volume.update(validate=True)
+    # The new volume may not be described yet (eventual consistency), so
+    # it is still pending while it is missing
+    volume = wait_for('volume', volume.id, region,
+                      lambda v: v is not None and v.status != "creating")
+    if volume.status == "error":
+        raise ErrorCreatingVolume("Error creating volume: volume status is "
+                                  "error")
+    cache_store('volume', region, volume)
     if tags is not None:
+        newtags = {}
         if savetags:
+            # Tags with the aws prefix are reserved
             for tagkey, tagvalue in tags.iteritems():
-                if tagkey == 'Name' and name is not None:
-                    create_volume_tag(volume.id, region, 'Name', name)
-                else:
-                    create_volume_tag(volume.id, region, tagkey, tagvalue)
-        else:
-            if name is not None:
-                create_volume_tag(volume.id, region, 'Name', name)
+                if tagkey.split(':')[0] != 'aws':
+                    newtags[tagkey] = tagvalue
+        if name is not None:
+            newtags['Name'] = name
+        queue_tags(volume.id, region, newtags)
     return(volume)
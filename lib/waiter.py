@@ -0,0 +1,249 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from apiprofile import get_profile
+from connection import ec2conn
+from threading import Condition, Event, Lock, Thread, current_thread
+from time import time
+
+# First interval (seconds) between polls, and growth factor of the interval
+# while no waits are finished
+MIN_INTERVAL = 2
+BACKOFF = 1.5
+
+# Maximum interval (seconds) between polls for each resource type
+MAX_INTERVALS = {
+    'instance': 15,
+    'modification': 30,
+    'snapshot': 60,
+    'volume': 10,
+}
+
+
+def _describe_modifications(conn, ids):
+    from volumes import get_volume_modifications
+    return(get_volume_modifications(conn, ids))
+
+
+# Describe calls for each resource type. Filters are used instead of ids so
+# resources that do not exist anymore are just missing from the result
+DESCRIBE = {
+    'instance': lambda conn, ids: conn.get_only_instances(
+        filters={'instance-id': ids}),
+    'modification': _describe_modifications,
+    'snapshot': lambda conn, ids: conn.get_all_snapshots(
+        filters={'snapshot-id': ids}),
+    'volume': lambda conn, ids: conn.get_all_volumes(
+        filters={'volume-id': ids}),
+}
+
+
+_waiters = {}
+_waiters_lock = Lock()
+
+
+class PendingWait(object):
+    """ A wait registered at a Waiter
+
+    Properties:
+        condition: A function receiving the resource (or None if it does not
+                   exist) and returning True when the wait is finished
+        resource: The resource that finished the wait
+        error: An exception raised while polling the resource
+    """
+
+    def __init__(self, condition):
+        self.condition = condition
+        self.resource = None
+        self.error = None
+        self.event = Event()
+
+
+class Waiter(object):
+    """ Service to wait for EC2 resources in a region to reach a state
+
+        All the pending waits for a resource type are polled together with a
+        single Describe call per tick, from a single thread. The interval
+        between polls starts short and grows while nothing changes.
+
+    Properties:
+        region: A string with the AWS region where the resources are
+    """
+
+    def __init__(self, region):
+        self.region = region
+        self.lock = Condition()
+        self.pending = {}
+        self.intervals = {}
+        self.next_poll = {}
+        self.thread = None
+
+    def wait(self, rtype, resource_id, condition):
+        """ Wait until a resource meets a condition
+
+        Args:
+            rtype: A string with the resource type (see DESCRIBE)
+            resource_id: A string with the resource id
+            condition: A function receiving the resource (or None if it does
+                       not exist) and returning True when the wait is
+                       finished
+        Returns:
+            The boto object for the resource, or None if it does not exist
+        Raises:
+            Any exception raised while polling the resource
+        """
+        wait = PendingWait(condition)
+        with self.lock:
+            waits = self.pending.setdefault(rtype, {})
+            waits.setdefault(resource_id, []).append(wait)
+            # Poll soon, as the resource has just changed
+            next_poll = time() + MIN_INTERVAL
+            self.intervals[rtype] = MIN_INTERVAL
+            self.next_poll[rtype] = min(self.next_poll.get(rtype, next_poll),
+                                        next_poll)
+            if self.thread is None:
+                self.thread = Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.lock.notify()
+        start = time()
+        # Wait with a timeout so the main thread can still be interrupted
+        while not wait.event.wait(1):
+            pass
+        profile = get_profile()
+        if profile is not None:
+            profile.record_wait(rtype, time() - start)
+        if wait.error is not None:
+            raise wait.error
+        if wait.resource is not None:
+            # The resource was fetched by the polling thread
+            wait.resource.connection = ec2conn(self.region)
+        return(wait.resource)
+
+    def _run(self):
+        try:
+            self._poll_pending()
+        except Exception as e:
+            # Fail the pending waits instead of leaving them hanging
+            with self.lock:
+                for waits in self.pending.values():
+                    for resource_waits in waits.values():
+                        for wait in resource_waits:
+                            wait.error = e
+                            wait.event.set()
+                    waits.clear()
+        finally:
+            # Let the next wait start a new thread, even if this one failed
+            with self.lock:
+                if self.thread is current_thread():
+                    self.thread = None
+
+    def _poll_pending(self):
+        while True:
+            with self.lock:
+                while True:
+                    rtypes = [rtype for rtype, waits in self.pending.items()
+                              if waits]
+                    if not rtypes:
+                        self.thread = None
+                        return
+                    now = time()
+                    due = [rtype for rtype in rtypes
+                           if self.next_poll[rtype] <= now]
+                    if due:
+                        break
+                    self.lock.wait(min([self.next_poll[rtype]
+                                        for rtype in rtypes]) - now)
+                polls = [(rtype, dict([(resource_id, list(waits))
+                                       for resource_id, waits in
+                                       self.pending[rtype].items()]))
+                         for rtype in due]
+            for rtype, waits in polls:
+                self._poll(rtype, waits)
+
+    def _describe(self, rtype, ids, resources):
+        for resource in DESCRIBE[rtype](ec2conn(self.region), ids):
+            resources[resource.id] = resource
+
+    def _poll(self, rtype, waits):
+        resources = {}
+        errors = {}
+        profile = get_profile()
+        if profile is not None:
+            profile.record_poll(rtype, len(waits))
+        try:
+            self._describe(rtype, waits.keys(), resources)
+        except Exception as e:
+            if len(waits) == 1:
+                errors[waits.keys()[0]] = e
+            else:
+                # Describe the resources one by one, so only the waits for
+                # the resources whose call fails are failed
+                for resource_id in waits.keys():
+                    try:
+                        self._describe(rtype, [resource_id], resources)
+                    except Exception as e:
+                        errors[resource_id] = e
+        finished = False
+        with self.lock:
+            pending = self.pending[rtype]
+            for resource_id, resource_waits in waits.items():
+                for wait in resource_waits:
+                    if resource_id in errors:
+                        wait.error = errors[resource_id]
+                    else:
+                        # A failing condition finishes only its own wait
+                        try:
+                            if not wait.condition(
+                                    resources.get(resource_id)):
+                                continue
+                            wait.resource = resources.get(resource_id)
+                        except Exception as e:
+                            wait.error = e
+                    pending[resource_id].remove(wait)
+                    wait.event.set()
+                    finished = True
+                if not pending[resource_id]:
+                    del pending[resource_id]
+            if finished:
+                self.intervals[rtype] = MIN_INTERVAL
+            else:
+                self.intervals[rtype] = min(self.intervals[rtype] * BACKOFF,
+                                            MAX_INTERVALS[rtype])
+            self.next_poll[rtype] = time() + self.intervals[rtype]
+
+
+def wait_for(rtype, resource_id, region, condition):
+    """ Wait until an EC2 resource meets a condition (see Waiter.wait)
+
+    Args:
+        rtype: A string with the resource type (see DESCRIBE)
+        resource_id: A string with the resource id
+        region: A string with the AWS region where the resource is
+        condition: A function receiving the resource (or None if it does not
+                   exist) and returning True when the wait is finished
+    Returns:
+        The boto object for the resource, or None if it does not exist
+    """
+    with _waiters_lock:
+        waiter = _waiters.get(region)
+        if waiter is None:
+            waiter = _waiters[region] = Waiter(region)
+    return(waiter.wait(rtype, resource_id, condition))
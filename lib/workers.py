@@ -0,0 +1,149 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from Queue import Queue
+from messages import task_prefix
+from threading import Event, Thread
+
+# Default number of worker threads for parallel tasks
+DEFAULT_MAX_WORKERS = 10
+# Seconds between checks while waiting for tasks and threads
+WAIT_INTERVAL = 1
+
+
+class Future(object):
+    """ Result of a task submitted to a WorkerPool
+
+    Properties:
+        name: A string identifying the task (for example, a volume-id)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._done = Event()
+        self._result = None
+        self._error = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_error(self, error):
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        """ Return True if the task finished """
+        return(self._done.is_set())
+
+    def wait(self):
+        """ Wait for the task to finish
+
+        Waits with a timeout in a loop, since an Event.wait() without
+        timeout blocks the signals (for example, SIGINT) on Python 2
+        """
+        while not self._done.wait(WAIT_INTERVAL):
+            pass
+
+    def error(self):
+        """ Wait for the task and return the exception it raised, or None """
+        self.wait()
+        return(self._error)
+
+    def result(self):
+        """ Wait for the task and return its result
+
+        Raises:
+            The exception raised by the task, if any
+        """
+        self.wait()
+        if self._error is not None:
+            raise self._error
+        return(self._result)
+
+
+class WorkerPool(object):
+    """ Pool with a bounded number of worker threads to run tasks
+
+    Properties:
+        max_workers: An integer with the maximum number of threads
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self.queue = Queue()
+        self.threads = []
+
+    def _work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            future, function, args, kwargs = task
+            # Messages printed by the task are prefixed with its name
+            with task_prefix(future.name):
+                try:
+                    future.set_result(function(*args, **kwargs))
+                except BaseException as e:
+                    # Never leave the future unset, or its waiter would
+                    # hang forever
+                    future.set_error(e)
+
+    def submit(self, name, function, *args, **kwargs):
+        """ Queue a task for the pool
+
+        Args:
+            name: A string identifying the task
+            function: The function to run
+            *args, **kwargs: The arguments for the function
+        Returns:
+            A Future object for the task
+        """
+        future = Future(name)
+        self.queue.put((future, function, args, kwargs))
+        if len(self.threads) < self.max_workers:
+            thread = Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return(future)
+
+    def shutdown(self):
+        """ Wait until all the queued tasks are finished and stop the
+            threads
+        """
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            # A join() without timeout would block the signals on Python 2
+            while thread.is_alive():
+                thread.join(WAIT_INTERVAL)
+        self.threads = []
+
+
+def failed_futures(futures):
+    """ Wait for a list of futures and return the ones that failed
+
+    Args:
+        futures: A list of Future objects
+    Returns:
+        A list of Future objects whose task raised an exception
+    """
+    return([future for future in futures if future.error() is not None])
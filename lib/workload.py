@@ -0,0 +1,125 @@
+# ebs-tools, a set of tools to manage EBS volumes and snapshots
+#
+# Copyright (C) 2014 Julio Gonzalez Gil <julio@juliogonzalez.es>
+#
+# This file is part of ebs-tools (http://github.com/juliogonzalez/ebs-tools)
+#
+# ebs-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ebs-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ebs-tools.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from calendar import timegm
+from datetime import datetime
+from random import Random
+from retention import SnapshotRecord
+
+# Interval (seconds) between snapshots for each cadence. For irregular
+# volumes, it is the mean interval
+CADENCES = {
+    '15min': 900,
+    'hourly': 3600,
+    'daily': 86400,
+    'irregular': 6 * 3600,
+}
+
+SECONDS_PER_YEAR = 365 * 86400
+
+
+class Workload(object):
+    """ Generator of synthetic snapshot inventories, similar to the ones of
+        real accounts
+
+        Snapshots are generated volume by volume and from the newest to the
+        oldest, so no more than a snapshot is in memory at once. Every volume
+        has its own random generator, so a volume always gets the same
+        snapshots for the same seed.
+
+    Properties:
+        volumes: An integer with the number of volumes
+        cadence: A string with the cadence of the snapshots (see CADENCES),
+                 or 'mixed' to choose a cadence for each volume
+        years: A number with the years of snapshots for each volume
+        gap_rate: A float with the probability of a gap (no snapshots, for
+                  example because of an outage) after each snapshot
+        max_gap_days: An integer with the maximum length of a gap (days,
+                      gaps are at least one snapshot interval long)
+        jitter: An integer with the maximum delay (seconds) of a snapshot
+                after its scheduled time, for regular cadences
+        seed: An integer with the seed for the random generators
+        now: An integer with the time of the newest snapshots (seconds since
+             the epoch, default is now)
+    """
+
+    def __init__(self, volumes=1, cadence='hourly', years=1, gap_rate=0.001,
+                 max_gap_days=30, jitter=300, seed=0, now=None):
+        if cadence != 'mixed' and cadence not in CADENCES:
+            raise ValueError('Unknown cadence %s' % cadence)
+        self.volumes = volumes
+        self.cadence = cadence
+        self.years = years
+        self.gap_rate = gap_rate
+        self.max_gap_days = max_gap_days
+        self.jitter = jitter
+        self.seed = seed
+        if now is None:
+            now = timegm(datetime.utcnow().timetuple())
+        self.now = now
+
+    def volume_id(self, index):
+        """ Return the volume-id for a volume index """
+        return('vol-%017x' % index)
+
+    def iter_snapshots(self, index):
+        """ Generate the snapshots for a volume
+
+        Args:
+            index: An integer with the volume index
+        Returns:
+            A generator of retention.SnapshotRecord objects, from the newest
+            to the oldest
+        """
+        random = Random(self.seed * 1000003 + index)
+        cadence = self.cadence
+        if cadence == 'mixed':
+            cadence = random.choice(sorted(CADENCES))
+        interval = CADENCES[cadence]
+        # Irregular volumes are already random, and the jitter must not
+        # change the order of the snapshots
+        jitter = min(self.jitter, interval - 1)
+        if cadence == 'irregular':
+            jitter = 0
+        oldest = self.now - int(self.years * SECONDS_PER_YEAR)
+        scheduled = self.now - self.now % interval - jitter
+        count = 0
+        while scheduled > oldest:
+            yield SnapshotRecord('snap-%08x%09x' % (index, count),
+                                 scheduled + random.randint(0, jitter))
+            count += 1
+            if cadence == 'irregular':
+                scheduled -= int(random.expovariate(1.0 / interval)) + 1
+            else:
+                scheduled -= interval
+            if random.random() < self.gap_rate:
+                # A gap skips at least one snapshot
+                scheduled -= random.randint(
+                    interval, max(interval, self.max_gap_days * 86400))
+
+    def iter_volumes(self):
+        """ Generate the volumes, with their snapshots
+
+        Returns:
+            A generator of tuples (volume_id, snapshots), where snapshots is
+            a generator as returned by iter_snapshots
+        """
+        for index in xrange(self.volumes):
+            yield((self.volume_id(index), self.iter_snapshots(index)))